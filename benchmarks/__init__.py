@@ -0,0 +1,4 @@
+"""
+Timing benchmarks for the load, process, reduce, render and publish stages, on generated datasets of several sizes.
+Run with `python3 -m benchmarks`, see `--help`.
+"""
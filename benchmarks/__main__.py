@@ -0,0 +1,252 @@
+"""
+Benchmark each stage on generated fleets, write the timings as JSON and compare them to a stored baseline.
+Exits with 1 if any stage is slower than the baseline by more than the tolerance.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from proc_code import generate_fleet
+from proc_code import load_data
+from proc_code import metadata
+from proc_code import path_tools
+from proc_code import process_data
+from proc_code import profiling
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "baseline.json")
+RESULTS_FILE = os.path.join(path_tools.REPO_BASE_DIR, "output", "benchmarks.json")
+
+#Run fn repeat times, setup before each run is not timed. Output of the stage is discarded.
+def time_stage(fn: Callable[[], Any], repeat: int, setup: Callable[[], Any] | None = None) -> Dict[str, float]:
+    times: List[float] = []
+    for _ in range(repeat):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times)}
+
+#Reading with name patterns must give the same entries as filtering a full read, also when the root keys of
+#result.json come in another order than the data collector writes them
+def check_read_result(folders: List[str], wanted: List[str], work_dir: str):
+    wanted_re = load_data.compile_name_patterns(wanted)
+    for folder in folders:
+        full = load_data.read_result(folder, False)
+        copy = os.path.join(work_dir, "reordered")
+        shutil.rmtree(copy, ignore_errors=True)
+        os.makedirs(copy)
+        with open(os.path.join(folder, "result.json")) as f:
+            root = json.load(f)
+        with open(os.path.join(copy, "result.json"), "w") as f:
+            json.dump(dict(reversed(root.items())), f)
+
+        for res in (load_data.read_result(folder, False, wanted), load_data.read_result(copy, False, wanted)):
+            if full is None or res is None or res.content != [c for c in full.content if wanted_re.fullmatch(c.name)]:
+                raise ValueError(f"Reading {folder} with {wanted} does not match the full read")
+    shutil.rmtree(os.path.join(work_dir, "reordered"), ignore_errors=True)
+
+#Worker processes must send back only their own spans, every stage is counted as often as in a serial run
+def check_profiling_counts(meta: metadata.Metadata, jobs: int):
+    counts = []
+    profiling.enable()
+    try:
+        for j in (1, jobs):
+            profiling.take_stats()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                process_data.process_all_plugs(meta, 3, j)
+            counts.append({stage: v[0] for stage, v in profiling.stage_totals(profiling.take_stats()).items()})
+    finally:
+        profiling.disable()
+    if counts[0] != counts[1]:
+        raise ValueError(f"Span counts differ between 1 and {jobs} jobs: {counts[0]} != {counts[1]}")
+
+def run_size(plugs: int, experiments: int, repeat: int, work_dir: str, payload_bytes: int) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+
+    def bench(name: str, items: int, fn: Callable[[], Any], setup: Callable[[], Any] | None = None):
+        res = time_stage(fn, repeat, setup)
+        results[name] = {"items": items} | res
+        print(f"  {name:<30} {items:>7} items {res['median']:>10.4f}s {1e6 * res['median'] / max(items, 1):>10.1f}us/item")
+
+    has_pil = importlib.util.find_spec("PIL") is not None
+
+    data_dir = os.path.join(work_dir, f"fleet_{plugs}")
+    print(f"Generating {plugs} plugs in {data_dir}")
+    generate_fleet.generate_fleet(data_dir, plugs, experiments, seed=plugs, payload_bytes=payload_bytes, photos=1 if has_pil else 0)
+    path_tools.set_data_dir(data_dir)
+
+    # Load
+
+    meta = metadata.read_charger_metadata_table()
+    bench("read_charger_metadata_table", len(meta.plugs), metadata.read_charger_metadata_table)
+
+    plug_paths = [plug.get_path() for plug in meta.plugs.values()]
+    bench("find_experiment_folders", len(plug_paths), lambda: [load_data.find_experiment_folders(p) for p in plug_paths])
+    bench("build_experiment_index", len(plug_paths), lambda: load_data.build_experiment_index(use_cache=False))
+
+    for plug in meta.plugs.values():
+        load_data.read_plug_experiments(plug)
+    folders = [exp.path for plug in meta.plugs.values() for exp in plug.experiments or []]
+
+    bench("regenerate_result_json", len(folders), lambda: [load_data.regenerate_result_json(f) for f in folders])
+
+    #Damaged backups can not be regenerated, these have no result.json to read
+    readable = [f for f in folders if os.path.exists(os.path.join(f, "result.json"))]
+    bench("read_result", len(readable), lambda: [load_data.read_result(f, False) for f in readable])
+    check_read_result(readable[:20], process_data.processed_traces(), work_dir)
+    bench("read_result_selective", len(readable), lambda: [load_data.read_result(f, False, process_data.processed_traces()) for f in readable])
+
+    # Process
+
+    #Results are appended to the experiments, start from fresh ones every run
+    def reset_experiments():
+        for plug in meta.plugs.values():
+            load_data.read_plug_experiments(plug)
+
+    def process_experiments():
+        for plug in meta.plugs.values():
+            plug.experiments = [exp for exp in plug.experiments or [] if process_data.process_experiment(plug, exp)]
+
+    bench("process_experiment", len(folders), process_experiments, reset_experiments)
+    check_profiling_counts(meta, 3)
+
+    # Reduce
+
+    processed = [plug for plug in meta.plugs.values() if plug.experiments]
+    bench("compact_results", len(processed), lambda: [process_data.compact_results(plug) for plug in processed])
+    bench("calculate_stats", len(processed), lambda: [process_data.calculate_stats(plug, [exp.time for exp in plug.experiments or []]) for plug in processed])
+    bench("calculate_final", len(processed), lambda: [process_data.calculate_final(plug) for plug in processed])
+
+    plug_list = list(meta.plugs.values())
+    bench("compute_stats", len(plug_list), lambda: process_data.compute_stats(plug_list, os.path.join(work_dir, "output")))
+    bench("compute_stats_intervals", len(plug_list), lambda: process_data.compute_stats_intervals(plug_list, os.path.join(work_dir, "output")))
+    bench("compute_breakdowns", len(plug_list), lambda: process_data.compute_breakdowns(plug_list, folder=os.path.join(work_dir, "output")))
+
+    # Render
+
+    if importlib.util.find_spec("quart") is not None:
+        from proc_code.webserver import page_gen
+        from proc_code.webserver import plug_list as plug_list_api
+
+        global_js: List[str] = []
+        bench("create_park_entry", len(meta.parks), lambda: [page_gen.create_park_entry(park, False, global_js) for park in meta.parks.values()])
+        rows = plug_list_api.PlugList(meta)
+        bench("plug_list_rows", len(plug_list), lambda: (rows.invalidate(), rows.get_rows()))
+        bench("plug_list_query", len(plug_list), lambda: (rows.invalidate(), rows.query({"sort": "-tls_support"}), rows.query({"sort": "town", "tls_support": "2"})))
+    else:
+        print("  Skipping page rendering, Quart is not installed")
+
+    if has_pil:
+        from proc_code.webserver import thumbs
+
+        photos = [path_tools.get_photo_dir(f) for park in meta.parks.values() for f in park.get_photos()]
+        thumbs_dir = os.path.join(work_dir, "thumbs_out")
+        bench("make_thumbnail", len(photos), lambda: [thumbs.make_thumbnail(os.path.join(path_tools.PHOTOS_DIR, p), os.path.join(thumbs_dir, p), 200, 0) for p in photos])
+    else:
+        print("  Skipping thumbnails, Pillow is not installed")
+
+    # Publish
+
+    if has_pil and importlib.util.find_spec("tqdm") is not None and importlib.util.find_spec("quart") is not None:
+        from proc_code import publish
+
+        photos = [f for park in meta.parks.values() for f in park.get_photos()]
+        bench("compress_photo_list", len(photos), lambda: publish.compress_photo_list(photos, os.path.join(work_dir, "photos_out"), 300))
+    else:
+        print("  Skipping photo compression, Pillow, tqdm or Quart is not installed")
+
+    shutil.rmtree(data_dir)
+    return results
+
+#Stages slower than the baseline median by more than the tolerance. Differences below min_time are noise.
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_time: float) -> List[str]:
+    regressions: List[str] = []
+    for size, stages in results["results"].items():
+        for stage, res in stages.items():
+            base = baseline["results"].get(size, {}).get(stage)
+            if base is None:
+                continue
+            ratio = res["median"] / base["median"] if base["median"] > 0 else 1.0
+            slower = res["median"] > base["median"] * (1 + tolerance) and res["median"] - base["median"] > min_time
+            print(f"  {stage + '@' + size:<36} {base['median']:>10.4f}s -> {res['median']:>10.4f}s ({ratio:.2f}x){'  REGRESSION' if slower else ''}")
+            if slower:
+                regressions.append(f"{stage}@{size}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the processing stages on generated data")
+    parser.add_argument("--sizes", default="100,1000", help="Comma separated numbers of plugs to generate")
+    parser.add_argument("--experiments", type=int, default=2, help="Experiments per plug")
+    parser.add_argument("--payload-bytes", type=int, default=0, help="Size of unused capture data in each experiment")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the median is compared")
+    parser.add_argument("--output", default=RESULTS_FILE, help="Where to write the results JSON")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline results JSON to compare to")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline, as a fraction")
+    parser.add_argument("--min-time", type=float, default=0.005, help="Ignore slowdowns smaller than this many seconds")
+    parser.add_argument("--work-dir", default=None, help="Folder for the generated data, a temporary folder by default")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    results: Dict[str, Any] = {
+        "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "experiments": args.experiments,
+        "payload_bytes": args.payload_bytes,
+        "repeat": args.repeat,
+        "results": {},
+    }
+
+    work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix="ev_bench_")
+    try:
+        for size in sizes:
+            results["results"][str(size)] = run_size(size, args.experiments, args.repeat, work_dir, args.payload_bytes)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline on the reference machine to create one")
+        return
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    if baseline["experiments"] != args.experiments or baseline["payload_bytes"] != args.payload_bytes:
+        print("Warning: Baseline was recorded with different dataset options")
+
+    print("Compared to baseline:")
+    regressions = compare(results, baseline, args.tolerance, args.min_time)
+    if len(regressions) > 0:
+        print(f"{len(regressions)} stages regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ from . import publish
 from . import path_tools
 from . import metadata
 from . import process_data
+from .webserver import page_gen
 from .webserver import webserver
 
 from multiprocessing import Process
@@ -53,11 +54,17 @@ async def main():
 
     # Get home page
     my_wget(s, "index.html")
+    my_wget(s, "api/plugs.json")
     my_wget(s, "static/index.css")
     my_wget(s, "static/index.js")
     for park in meta.parks.values():
         my_wget(s, "page/" + park.id + ".html") 
 
+    # Thumbnails shown in the pages, the full photos are already in the data folder
+    photos = [f for p in meta.parks.values() for f in p.get_photos()] + [f for c in meta.chargers.values() for f in c.get_photos()]
+    for fn in photos:
+        my_wget(s, f"thumbs/{page_gen.PHOTO_HEIGHT}/" + path_tools.get_photo_dir(fn))
+
     print("Stopping server")
     p.terminate()
     p.join()
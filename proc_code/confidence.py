@@ -0,0 +1,175 @@
+"""
+Confidence intervals for the fleet verdict percentages of fleet_table crosstabs.
+Wilson score intervals treat every plug as independent. The bootstrap resamples whole parks, since the chargers of a park
+share an operator and configuration. All resamples of a cell are drawn at once as multinomial park weights and reduced
+with a matrix product, no Python loop over resamples.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from . import fleet_table
+
+#Resamples per matrix product are limited so the weights stay below this many elements
+BOOTSTRAP_CHUNK_ELEMENTS = 1 << 22
+
+#Percentage of plugs with a "yes" verdict (1 sometimes, 2 always), with its interval, per crosstab cell
+@dataclass
+class Intervals:
+    stats: List[str]
+    columns: List[str]
+    level: float
+    #Of shape (stats, columns). Percentages are NaN for cells without plugs.
+    yes: np.ndarray
+    n: np.ndarray
+    percent: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+
+    #{stat: {column: (percent, lower, upper)}}
+    def to_dict(self) -> Dict[str, Dict[str, Tuple[float, float, float]]]:
+        return {
+            stat: {col: (float(self.percent[i, j]), float(self.lower[i, j]), float(self.upper[i, j])) for j, col in enumerate(self.columns)}
+            for i, stat in enumerate(self.stats)
+        }
+
+    #Same layout as Crosstab.write_csv, each cell is "percent [lower, upper]"
+    def write_csv(self, path: str):
+        def cell(i: int, j: int) -> str:
+            if self.n[i, j] == 0:
+                return "-"
+            return fleet_table.csv_cell(f"{self.percent[i, j]:.1f} [{self.lower[i, j]:.1f}, {self.upper[i, j]:.1f}]")
+
+        with open(path, "w") as f:
+            f.write(", ".join([""] + [fleet_table.csv_cell(col) for col in self.columns]))
+            f.write("\n")
+            for i, stat in enumerate(self.stats):
+                f.write(", ".join([fleet_table.csv_cell(stat)] + [cell(i, j) for j in range(len(self.columns))]))
+                f.write("\n")
+
+def z_value(level: float) -> float:
+    return NormalDist().inv_cdf(0.5 + level / 2)
+
+def yes_no(counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return counts[..., 1] + counts[..., 2], counts.sum(axis=-1)
+
+def percent(yes: np.ndarray, n: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return 100 * yes / n
+
+#Wilson score interval of the fractions yes / n, in percent. NaN where n is 0.
+def wilson(yes: np.ndarray, n: np.ndarray, level: float = 0.95) -> Tuple[np.ndarray, np.ndarray]:
+    z = z_value(level)
+    yes = np.asarray(yes, dtype=np.float64)
+    n = np.asarray(n, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = yes / n
+        denom = 1 + z * z / n
+        center = (p + z * z / (2 * n)) / denom
+        half = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return 100 * np.clip(center - half, 0, 1), 100 * np.clip(center + half, 0, 1)
+
+def wilson_intervals(crosstab: fleet_table.Crosstab, level: float = 0.95) -> Intervals:
+    yes, n = yes_no(crosstab.counts)
+    lower, upper = wilson(yes, n, level)
+    return Intervals(crosstab.stats, crosstab.columns, level, yes, n, percent(yes, n), lower, upper)
+
+#Quantiles along the first axis, ignoring NaN. Faster than np.nanquantile for many columns.
+def nan_quantiles(x: np.ndarray, qs: List[float]) -> List[np.ndarray]:
+    x = np.sort(x, axis=0)
+    valid = (~np.isnan(x)).sum(axis=0)
+    res: List[np.ndarray] = []
+    for q in qs:
+        pos = q * np.maximum(valid - 1, 0)
+        lo = np.floor(pos).astype(np.intp)
+        hi = np.minimum(lo + 1, np.maximum(valid - 1, 0))
+        frac = pos - lo
+        v = np.take_along_axis(x, lo[None], axis=0)[0] * (1 - frac) + np.take_along_axis(x, hi[None], axis=0)[0] * frac
+        res.append(np.where(valid > 0, v, np.nan))
+    return res
+
+#Percentile intervals of the verdict percentages, resampling the clusters (parks by default) with replacement.
+#Arguments select the cells as in FleetTable.crosstab.
+def bootstrap_intervals(
+    table: fleet_table.FleetTable, stats: Dict[str, str] | List[str], groups: List[str] = [], columns: List[str] | None = None,
+    resamples: int = 2000, level: float = 0.95, seed: int = 0, cluster: str = "park"
+) -> Intervals:
+    if not isinstance(stats, dict):
+        stats = {f: f for f in stats}
+
+    fields = list(stats.values())
+    cell, labels = table.column_codes(groups, columns)
+    #Plugs not in a listed column have cell len(labels), ALL is the next one
+    all_col = len(labels) + 1
+    n_cols = len(labels) + 1
+    clusters = table.categories[cluster]
+    n_clusters = len(clusters.labels)
+
+    #Only the distribution of each cell on its own is needed for its interval. For a cell, clusters with the same yes and n
+    #are drawn as one category with the summed probability, and all clusters without plugs in the cell as another.
+    #The counts of merged categories of a multinomial are again multinomial, so this is exact and needs only a few
+    #categories per cell, instead of one weight per cluster.
+    yes = np.zeros((len(fields), n_cols), dtype=np.int64)
+    n = np.zeros((len(fields), n_cols), dtype=np.int64)
+    #Per cell: (yes, n) of each category and the number of clusters in it
+    profiles: List[List[Tuple[np.ndarray, np.ndarray, np.ndarray]]] = []
+    for f in fields:
+        v = table.verdicts[f]
+        valid = v >= 0
+        park = clusters.codes[valid].astype(np.int64)
+        col = cell[valid].astype(np.int64)
+        is_yes = (v[valid] >= 1).astype(np.int64)
+
+        #yes and n of each cluster in each column, counting every plug also in ALL
+        keys, inverse = np.unique(np.concatenate([col * n_clusters + park, all_col * n_clusters + park]), return_inverse=True)
+        cluster_n = np.bincount(inverse, minlength=len(keys))
+        cluster_yes = np.bincount(inverse, weights=np.concatenate([is_yes, is_yes]), minlength=len(keys)).astype(np.int64)
+        cluster_col = keys // n_clusters
+
+        #Distinct (column, n, yes) and how many clusters have them, sorted by column
+        base = int(cluster_n.max(initial=0)) + 1
+        combined, sizes = np.unique((cluster_col * base + cluster_n) * base + cluster_yes, return_counts=True)
+        p_col = combined // (base * base)
+        p_n = combined // base % base
+        p_yes = combined % base
+        bounds = np.searchsorted(p_col, np.arange(all_col + 2))
+
+        row: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        for c in list(range(len(labels))) + [all_col]:
+            sl = slice(bounds[c], bounds[c + 1])
+            row.append((p_yes[sl], p_n[sl], sizes[sl]))
+        profiles.append(row)
+
+    rng = np.random.default_rng(seed)
+    ratios = np.full((resamples, len(fields) * n_cols), np.nan)
+    for i in range(len(fields)):
+        for j, (p_yes, p_n, sizes) in enumerate(profiles[i]):
+            yes[i, j] = (p_yes * sizes).sum()
+            n[i, j] = (p_n * sizes).sum()
+            if len(sizes) == 0:
+                continue
+            #All yes or all no in every resample
+            if (p_yes == 0).all() or (p_yes == p_n).all():
+                ratios[:, i * n_cols + j] = p_yes[0] / p_n[0]
+                continue
+            probs = np.append(sizes, n_clusters - sizes.sum()) / n_clusters
+            values = np.stack([np.append(p_yes, 0), np.append(p_n, 0)], axis=1).astype(np.float64)
+
+            chunk = max(1, BOOTSTRAP_CHUNK_ELEMENTS // len(probs))
+            for start in range(0, resamples, chunk):
+                size = min(chunk, resamples - start)
+                sums = rng.multinomial(n_clusters, probs, size=size).astype(np.float64) @ values
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    ratios[start:start + size, i * n_cols + j] = sums[:, 0] / sums[:, 1]
+
+    shape = yes.shape
+    lower, upper = nan_quantiles(ratios, [(1 - level) / 2, (1 + level) / 2])
+    return Intervals(
+        list(stats.keys()), labels + [fleet_table.ALL], level, yes, n, percent(yes, n),
+        100 * lower.reshape(shape), 100 * upper.reshape(shape)
+    )
@@ -0,0 +1,45 @@
+"""
+Fingerprints of the inputs of the processed.json, reduced.json and overview.json caches.
+A cache entry is stale when the fingerprint stored in it no longer matches its inputs.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from typing import Any, Iterable, List
+
+#Size and modification time, None if the file does not exist
+def file_fingerprint(path: str) -> List[int] | None:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def hash_fingerprint(parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+#Inputs of processed.json: The raw results of the experiment
+def experiment_fingerprint(folder: str, version: int) -> str:
+    return hash_fingerprint([
+        version,
+        file_fingerprint(os.path.join(folder, "result.json")),
+        file_fingerprint(os.path.join(folder, "backup.bak.txt")),
+    ])
+
+#Inputs of reduced.json other than the experiments, which it records one by one
+def reduced_fingerprint(plug_path: str, version: int) -> str:
+    return hash_fingerprint([
+        version,
+        file_fingerprint(os.path.join(plug_path, "nmk_review.json")),
+    ])
+
+#Inputs of overview.json: The NMK review and all experiments of the plug
+def plug_fingerprint(plug_path: str, exp_folders: Iterable[str], version: int) -> str:
+    return hash_fingerprint([
+        version,
+        file_fingerprint(os.path.join(plug_path, "nmk_review.json")),
+        sorted([os.path.relpath(folder, plug_path), experiment_fingerprint(folder, version)] for folder in exp_folders),
+    ])
@@ -0,0 +1,239 @@
+"""
+Columnar table of the plug verdicts and metadata, for statistics over the whole fleet.
+Built once from the plugs, after which counts are computed with NumPy instead of looping over Plug objects.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import itertools
+import operator
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+import numpy as np
+
+from . import metadata
+from . import types
+
+#Integer verdict fields of FinalResult, see utils for their values. -1 also for plugs without a result.
+VERDICT_FIELDS = [
+    "nmk_random", "nid_match",
+    "tls_support", "tls_support_v13", "tls_support_v12", "tls_support_strong", "tls_support_weak", "tls_support_old",
+    "din_support", "v2v10_support", "v2v13_support", "v20dc_support",
+]
+
+UNKNOWN_YEAR = "????"
+
+#Column of a crosstab counting all plugs
+ALL = "ALL"
+
+#Between the labels of the group columns in the name of a crosstab column, such as DE/2021
+GROUP_SEPARATOR = "/"
+
+#Categorical columns from the metadata, by charger
+CHARGER_FIELDS: Dict[str, Callable[[types.Charger], str]] = {
+    "country": lambda charger: charger.park.id.split(".")[0],
+    "park": lambda charger: charger.park.id,
+    "park_type": lambda charger: charger.park.type,
+    "park_type2": lambda charger: charger.park.type2,
+    "manufacturer": lambda charger: charger.manufacturer,
+    "network": lambda charger: charger.network,
+    "year": lambda charger: str(charger.mfg_year) if charger.mfg_year is not None else UNKNOWN_YEAR,
+}
+
+#Categorical columns from the results, "" for plugs without a result
+RESULT_FIELDS = ["preferred", "phy_chip", "phy_fw"]
+
+class Category(NamedTuple):
+    #Index into labels for every plug
+    codes: np.ndarray
+    #Sorted distinct values
+    labels: List[str]
+
+def encode_category(values: List[str]) -> Category:
+    #Number values by first occurrence, then renumber in sorted order. Faster than sorting all values.
+    first_seen: Dict[str, int] = {}
+    codes = np.fromiter((first_seen.setdefault(v, len(first_seen)) for v in values), dtype=np.int32, count=len(values))
+    labels = sorted(first_seen)
+    remap = np.empty(len(labels), dtype=np.int32)
+    remap[np.array([first_seen[label] for label in labels], dtype=np.intp)] = np.arange(len(labels), dtype=np.int32)
+    return Category(remap[codes], labels)
+
+#"yes / no" as in output/tls.csv, where 1 (sometimes) counts as yes
+def format_counts(c: np.ndarray) -> str:
+    return f"{c[2] + c[1]} / {c[0]}"
+
+#Quote CSV cells that contain the separator
+def csv_cell(s: str) -> str:
+    if "," in s or "\"" in s or "\n" in s:
+        return "\"" + s.replace("\"", "\"\"") + "\""
+    return s
+
+#Verdict counts of several fields, broken down by the combinations of one or more group columns
+@dataclass
+class Crosstab:
+    #Row names, the verdict field is stored in fields
+    stats: List[str]
+    fields: List[str]
+    groups: List[str]
+    #Labels of the group columns joined with GROUP_SEPARATOR, the last column is ALL
+    columns: List[str]
+    #Number of plugs with each verdict 0, 1, 2, of shape (stats, columns, 3)
+    counts: np.ndarray
+
+    #{stat: {column: {verdict: count}}}, in the layout of process_data.compute_stats
+    def to_dict(self) -> Dict[str, Dict[str, Dict[int, int]]]:
+        return {
+            stat: {col: {0: int(c[0]), 1: int(c[1]), 2: int(c[2])} for col, c in zip(self.columns, self.counts[i])}
+            for i, stat in enumerate(self.stats)
+        }
+
+    #One row per stat and one column per group, each cell is "yes / no"
+    def write_csv(self, path: str):
+        with open(path, "w") as f:
+            f.write(", ".join([""] + [csv_cell(col) for col in self.columns]))
+            f.write("\n")
+            for stat, counts in zip(self.stats, self.counts):
+                f.write(", ".join([csv_cell(stat)] + [format_counts(c) for c in counts]))
+                f.write("\n")
+
+@dataclass
+class FleetTable:
+    plug_ids: List[str]
+    verdicts: Dict[str, np.ndarray]
+    categories: Dict[str, Category]
+
+    @staticmethod
+    def from_plugs(plugs: Iterable[types.Plug]) -> FleetTable:
+        plugs = list(plugs)
+
+        finals = [plug.final for plug in plugs]
+        get_verdicts = operator.attrgetter(*VERDICT_FIELDS)
+        no_result = (-1,) * len(VERDICT_FIELDS)
+        rows = np.fromiter(
+            itertools.chain.from_iterable(get_verdicts(final) if final is not None else no_result for final in finals),
+            dtype=np.int8, count=len(plugs) * len(VERDICT_FIELDS)
+        ).reshape(len(plugs), len(VERDICT_FIELDS))
+
+        #Metadata is looked up once per charger
+        charger_idx: Dict[str, int] = {}
+        chargers: List[types.Charger] = []
+        for plug in plugs:
+            if plug.charger.id not in charger_idx:
+                charger_idx[plug.charger.id] = len(chargers)
+                chargers.append(plug.charger)
+        plug_charger = np.fromiter((charger_idx[plug.charger.id] for plug in plugs), dtype=np.intp, count=len(plugs))
+
+        categories: Dict[str, Category] = {}
+        for k, get in CHARGER_FIELDS.items():
+            cat = encode_category([get(charger) for charger in chargers])
+            categories[k] = Category(cat.codes[plug_charger], cat.labels)
+        for k in RESULT_FIELDS:
+            categories[k] = encode_category([getattr(final, k) if final is not None else "" for final in finals])
+
+        return FleetTable(
+            plug_ids = [plug.id for plug in plugs],
+            verdicts = {f: np.ascontiguousarray(rows[:, i]) for i, f in enumerate(VERDICT_FIELDS)},
+            categories = categories,
+        )
+
+    @staticmethod
+    def from_metadata(meta: metadata.Metadata) -> FleetTable:
+        return FleetTable.from_plugs(meta.plugs.values())
+
+    def __len__(self) -> int:
+        return len(self.plug_ids)
+
+    #Value of a categorical column for every plug
+    def values(self, group: str) -> np.ndarray:
+        cat = self.categories[group]
+        return np.array(cat.labels, dtype=object)[cat.codes]
+
+    #Plugs where mask is set, labels of the categories are kept
+    def filter(self, mask: np.ndarray) -> FleetTable:
+        idx = np.flatnonzero(mask)
+        return FleetTable(
+            plug_ids = [self.plug_ids[i] for i in idx],
+            verdicts = {k: v[idx] for k, v in self.verdicts.items()},
+            categories = {k: Category(c.codes[idx], c.labels) for k, c in self.categories.items()},
+        )
+
+    #Number of plugs with each verdict 0, 1, 2 of field, per value of the group column. Plugs without data (-1) are not counted.
+    #Without a group, a single row for all plugs.
+    #Returns the labels of the rows and the counts, of shape (labels, 3).
+    def count_by(self, field: str, group: str | None = None) -> Tuple[List[str], np.ndarray]:
+        v = self.verdicts[field]
+        valid = v >= 0
+        if group is None:
+            return [ALL], np.bincount(v[valid], minlength=3).reshape(1, 3)
+
+        cat = self.categories[group]
+        idx = cat.codes[valid].astype(np.int64) * 3 + v[valid]
+        return cat.labels, np.bincount(idx, minlength=3 * len(cat.labels)).reshape(len(cat.labels), 3)
+
+    #Same as count_by, in the {label: {verdict: count}} layout of process_data.compute_stats
+    def count_dict(self, field: str, group: str | None = None) -> Dict[str, Dict[int, int]]:
+        labels, counts = self.count_by(field, group)
+        return {label: {0: int(c[0]), 1: int(c[1]), 2: int(c[2])} for label, c in zip(labels, counts)}
+
+    #Combination of the group columns of every plug as one code, and the labels of the codes that occur
+    def group_codes(self, groups: List[str]) -> Tuple[np.ndarray, List[str]]:
+        if len(groups) == 0:
+            return np.zeros(len(self), dtype=np.intp), []
+
+        cats = [self.categories[g] for g in groups]
+        combined = np.zeros(len(self), dtype=np.int64)
+        for cat in cats:
+            combined = combined * len(cat.labels) + cat.codes
+        cells, inverse = np.unique(combined, return_inverse=True)
+
+        #Split the combined codes back up, last group first
+        parts: List[np.ndarray] = []
+        rest = cells
+        for cat in reversed(cats):
+            parts.append(rest % len(cat.labels))
+            rest = rest // len(cat.labels)
+        parts.reverse()
+        labels = [GROUP_SEPARATOR.join(cat.labels[code] for cat, code in zip(cats, codes)) for codes in zip(*[p.tolist() for p in parts])]
+        return inverse.reshape(-1), labels
+
+    #Column of every plug for the groups, and the labels of the columns.
+    #columns fixes the columns and their order, plugs in combinations not listed get the index len(columns).
+    #Without columns, every combination that occurs is a column, sorted by label.
+    def column_codes(self, groups: List[str], columns: List[str] | None = None) -> Tuple[np.ndarray, List[str]]:
+        cell, labels = self.group_codes(groups)
+        if columns is None:
+            return cell, labels
+        col_idx = {col: i for i, col in enumerate(columns)}
+        if len(labels) == 0:
+            return np.full(len(self), len(columns), dtype=np.intp), list(columns)
+        return np.array([col_idx.get(label, len(columns)) for label in labels], dtype=np.intp)[cell], list(columns)
+
+    #Number of plugs with each verdict of fields in each column, of shape (fields, n_cols + 1, 3).
+    #The last column counts all plugs.
+    def count_cells(self, fields: List[str], cell: np.ndarray, n_cols: int) -> np.ndarray:
+        #An extra column for plugs outside of the columns, replaced by the total below
+        n_cols += 1
+        v = np.stack([self.verdicts[f] for f in fields]) if len(fields) > 0 else np.empty((0, len(self)), dtype=np.int8)
+        valid = v >= 0
+        idx = (np.arange(len(fields), dtype=np.int64)[:, None] * n_cols + cell[None, :]) * 3 + v
+        counts = np.bincount(idx[valid], minlength=len(fields) * n_cols * 3).reshape(len(fields), n_cols, 3)
+        counts[:, -1] = counts.sum(axis=1)
+        return counts
+
+    #Counts of all stats for every combination of the groups, in a single bincount.
+    #stats maps row names to verdict fields, or is a list of fields used as their own names.
+    #columns fixes the group columns and their order, combinations not listed only count towards ALL.
+    #Without columns, every combination that occurs is a column, sorted by label.
+    def crosstab(self, stats: Dict[str, str] | List[str], groups: List[str] = [], columns: List[str] | None = None) -> Crosstab:
+        if not isinstance(stats, dict):
+            stats = {f: f for f in stats}
+        fields = list(stats.values())
+
+        cell, labels = self.column_codes(groups, columns)
+        counts = self.count_cells(fields, cell, len(labels))
+        return Crosstab(list(stats.keys()), fields, list(groups), labels + [ALL], counts)
+
+    #Several crosstabs of the same stats, by name
+    def crosstabs(self, stats: Dict[str, str] | List[str], breakdowns: Dict[str, List[str]]) -> Dict[str, Crosstab]:
+        return {name: self.crosstab(stats, groups) for name, groups in breakdowns.items()}
@@ -0,0 +1,373 @@
+"""
+Generate a synthetic fleet of parks, chargers and plugs with raw experiments, for testing and benchmarking at scale.
+The output uses the same layout as data/, use it by setting EV_DATA_DIR or path_tools.set_data_dir.
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import random
+from dataclasses import dataclass
+from typing import Any, List, TextIO
+
+from . import load_data
+from . import metadata
+from . import path_tools
+from .nid import to_nid
+
+COUNTRIES = ["DE", "FR", "NL", "GB", "BE", "AT", "CH", "IT", "ES", "SE", "NO", "DK", "PL", "US"]
+TOWNS = ["Northfield", "Eastbrook", "Westmere", "Southport", "Kingsbridge", "Riverton", "Lakeside", "Hillcrest", "Millbrook", "Stoneham"]
+PARK_TYPES = ["Town", "Rural", "Motorway"]
+PARK_TYPES2 = ["Supermarket", "Service station", "Hotel", "Car park", "Restaurant"]
+
+MANUFACTURERS = ["ABB", "Alpitronic", "Tritium", "Kempower", "Siemens", "Delta", "Efacec", "Wallbox", "Huawei", "Circontrol"]
+NETWORKS = ["Ionity", "Fastned", "Allego", "Shell Recharge", "BP Pulse", "EnBW", "Tesla", "Electra", "InstaVolt", "Gridserve"]
+
+FIRMWARES = [
+    ("QCA7000", "MAC-QCA7000-1.1.0.727-02-20130826-FINAL"),
+    ("QCA7000", "MAC-QCA7000-1.1.3.1531-00-20150204-CS"),
+    ("QCA7000", "MAC-QCA7000-1.2.1.2025-00-20151013-CS"),
+    ("QCA7000", "MAC-QCA7000-3.1.0.14-00-20211111-CS"),
+    ("QCA7005", "MAC-QCA7005-1.2.3.2819-00-20170830-CS"),
+    ("QCA7005", "MAC-QCA7005-1.2.5.3207-00-20180927-CS"),
+    ("QCA7005", "MAC-QCA7005-3.0.0.18-00-20200826-CS"),
+]
+OUIS = ["00B052", "001EC0", "049162", "5410EC", "682719", "8C34FD", "60FAB1"]
+
+PROTOCOLS = ["DIN", "V2V10", "V2V13", "V20DC"]
+PROTOCOL_NAMESPACES = {
+    "DIN": "urn:din:70121:2012:MsgDef",
+    "V2V10": "urn:iso:15118:2:2010:MsgDef",
+    "V2V13": "urn:iso:15118:2:2013:MsgDef",
+    "V20DC": "urn:iso:std:iso:15118:-20:DC",
+}
+
+#Behaviour shared by all plugs of a charger, every experiment on it shows the same
+@dataclass
+class ChargerProfile:
+    supported: List[str]
+    preferred: str
+    tls: bool
+    tls_v13: bool
+    tls_strong: bool
+    tls_weak: bool
+    tls_old: bool
+    #0: Pattern, 1: Partial, 2: Random
+    nmk_style: int
+    nmk_static: str | None
+    nid_match: bool
+    chip: str
+    firmware: str
+    mac: str
+    evse_id: str
+
+def random_mac(rng: random.Random) -> str:
+    mac = rng.choice(OUIS) + "".join(rng.choice("0123456789ABCDEF") for _ in range(6))
+    return ":".join(mac[i:i+2] for i in range(0, 12, 2))
+
+def random_charger_profile(rng: random.Random, country: str, mfg_year: int | None) -> ChargerProfile:
+    newer = mfg_year is not None and mfg_year >= 2019
+
+    supported = ["DIN"] + [p for p, chance in [("V2V10", 0.2), ("V2V13", 0.6 if newer else 0.3), ("V20DC", 0.15 if newer else 0.02)] if rng.random() < chance]
+    tls = "V2V13" in supported and rng.random() < 0.4
+    chip, firmware = rng.choice(FIRMWARES)
+    nmk_style = rng.choices([0, 1, 2], [0.1, 0.05, 0.85])[0]
+
+    return ChargerProfile(
+        supported = supported,
+        preferred = rng.choice(supported[1:]) if len(supported) > 1 and rng.random() < 0.7 else "DIN",
+        tls = tls,
+        tls_v13 = tls and "V20DC" in supported,
+        tls_strong = tls,
+        tls_weak = tls and rng.random() < 0.3,
+        tls_old = tls and rng.random() < 0.1,
+        nmk_style = nmk_style,
+        nmk_static = random_nmk(rng, nmk_style) if nmk_style != 2 and rng.random() < 0.5 else None,
+        nid_match = rng.random() < 0.97,
+        chip = chip,
+        firmware = firmware,
+        mac = random_mac(rng),
+        evse_id = f"{country}*{rng.randint(100, 999)}*E{rng.randint(10000, 99999)}",
+    )
+
+def random_nmk(rng: random.Random, style: int) -> str:
+    if style == 2:
+        return rng.randbytes(16).hex().upper()
+    if style == 1:
+        return (rng.randbytes(8) + bytes(8)).hex().upper()
+    start = rng.randrange(256)
+    step = rng.choice([0, 1, 0x11])
+    return bytes([(start + i * step) % 256 for i in range(16)]).hex().upper()
+
+#Writes an experiment both as backup.bak.txt, and optionally as result.json in the same pass
+class ExperimentWriter():
+    def __init__(self, backup: TextIO, result: TextIO | None, time: datetime.datetime):
+        self.backup = backup
+        self.result = load_data.ResultJsonWriter(result) if result is not None else None
+        self.trace: List[str] = []
+        self.time = time
+        self.lines: List[str] = []
+
+    def now(self) -> str:
+        self.time += datetime.timedelta(milliseconds=37)
+        return self.time.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    def write(self, entry: Any):
+        self.backup.write(json.dumps(entry) + "\n")
+
+    def enter(self, name: str):
+        self.trace = self.trace + [name]
+        entry = {"version": 1, "type": "TRACE_ENTER", "trace": self.trace, "time": self.now()}
+        self.write(entry)
+        if self.result is not None:
+            self.result.enter(entry)
+
+    def leave(self):
+        entry = {"version": 1, "type": "TRACE_LEAVE", "trace": self.trace, "time": self.now()}
+        self.write(entry)
+        if self.result is not None:
+            self.result.leave(entry["time"])
+        self.trace = self.trace[:-1]
+
+    def entry(self, type: str, data: Any):
+        entry = {"version": 1, "type": type, "trace": self.trace, "time": self.now(), "data": data}
+        self.write(entry)
+        if self.result is not None:
+            self.result.entry(entry)
+
+def write_slac(w: ExperimentWriter, rng: random.Random, profile: ChargerProfile):
+    pev_mac = random_mac(rng)
+    w.enter("SLAC")
+    for _ in range(rng.randint(1, 2)):
+        nmk = profile.nmk_static if profile.nmk_static is not None else random_nmk(rng, profile.nmk_style)
+        nid = to_nid(bytes.fromhex(nmk)) if profile.nid_match else rng.randbytes(7)
+        w.entry("SLAC", {
+            "PEV_MAC": pev_mac,
+            "EVSE_MAC": profile.mac,
+            "EVSE_ID": profile.evse_id,
+            "NMK": nmk,
+            "NID": nid.hex().upper(),
+            "AAG": [rng.randint(10, 60) for _ in range(58)],
+        })
+    w.entry("NETWORK", {
+        "CCO_DA": profile.mac,
+        "STATIONS": [
+            {
+                "MAC": profile.mac,
+                "VERSION": {"IDENT": profile.chip, "VERSION": profile.firmware},
+                "IDENTITY": {"MFG": "HomePlug AV", "USR": "EVSE"},
+            },
+            {
+                "MAC": pev_mac,
+                "VERSION": None,
+                "IDENTITY": None,
+            },
+        ],
+    })
+    w.leave()
+
+def write_sdp(w: ExperimentWriter, profile: ChargerProfile, request_tls: bool):
+    w.enter("SDP_YTLS" if request_tls else "SDP_NTLS")
+    w.enter("SDP")
+    w.entry("REQ", {"tls": request_tls})
+    tls = request_tls and profile.tls
+    w.entry("RES", {"res": {"tls": tls, "port": 64109 if tls else 64110}})
+    w.leave()
+    w.leave()
+
+def write_supported(w: ExperimentWriter, profile: ChargerProfile, conn: str, protocol: str):
+    w.enter(f"SUPPORTED_{conn}_{protocol}")
+    w.enter("supportedAppProtocolReq")
+    w.entry("ENCODED", "8000dbab9371d3234b71d1b981899189d191818991d26b9b3a232b30020000040040")
+    w.leave()
+    w.enter("supportedAppProtocolRes")
+    chosen = profile.preferred if protocol == "ALL" else (protocol if protocol in profile.supported else None)
+    if chosen is None:
+        w.entry("DECODED", "<supportedAppProtocolRes><ResponseCode>Failed_NoNegotiation</ResponseCode></supportedAppProtocolRes>")
+    else:
+        w.entry("DECODED", f"<supportedAppProtocolRes><ResponseCode>OK_SuccessfulNegotiation</ResponseCode><SchemaID>1</SchemaID></supportedAppProtocolRes>")
+        w.entry("CHOSEN", {"name": chosen, "namespace": PROTOCOL_NAMESPACES[chosen]})
+    w.leave()
+    w.leave()
+
+def write_conn(w: ExperimentWriter, rng: random.Random, conn_type: str, inner: str, good: bool):
+    w.enter(conn_type)
+    w.enter(inner)
+    w.entry("CONNECT", {"port": 64109})
+    if good:
+        w.entry("HANDSHAKE", {"cipher": "TLS_ECDHE_ECDSA_WITH_AES_128_GCM_SHA256"})
+    else:
+        w.entry("EXCEPTION", "SSLError: [SSL: SSLV3_ALERT_HANDSHAKE_FAILURE] sslv3 alert handshake failure")
+    w.leave()
+    w.leave()
+
+#Large captures the analysis never reads
+def write_payload(w: ExperimentWriter, rng: random.Random, payload_bytes: int):
+    w.enter("CAPTURE")
+    chunk = 4096
+    for i in range(0, payload_bytes, chunk):
+        w.entry("RAW", rng.randbytes(min(chunk, payload_bytes - i)).hex())
+    w.leave()
+
+def write_experiment(folder: str, rng: random.Random, profile: ChargerProfile, time: datetime.datetime,
+        write_result: bool, payload_bytes: int):
+    os.makedirs(folder, exist_ok=True)
+
+    with open(os.path.join(folder, "backup.bak.txt"), "w") as fb:
+        fr = open(os.path.join(folder, "result.json"), "w") if write_result else None
+        try:
+            w = ExperimentWriter(fb, fr, time)
+            w.enter("TEST")
+            w.entry("INFO", {"v": 7, "tool": "synthetic", "time": time.strftime("%Y-%m-%d %H:%M:%S")})
+
+            write_slac(w, rng, profile)
+            write_sdp(w, profile, False)
+            write_sdp(w, profile, True)
+
+            write_supported(w, profile, "NTLS", "ALL")
+            for protocol in PROTOCOLS:
+                write_supported(w, profile, "NTLS", protocol)
+
+            if profile.tls:
+                write_conn(w, rng, "CONN_UTLS_V2", "UTLS", True)
+                write_conn(w, rng, "CONN_MTLS_V20", "MTLS", profile.tls_v13)
+                write_conn(w, rng, "CONN_TLS12_STRONG", "UTLS", profile.tls_strong)
+                write_conn(w, rng, "CONN_TLS12_WEAK", "UTLS", profile.tls_weak)
+                write_conn(w, rng, "CONN_OLD_TLS", "UTLS", profile.tls_old)
+
+            if payload_bytes > 0:
+                write_payload(w, rng, payload_bytes)
+            w.leave()
+            if w.result is not None:
+                w.result.close()
+        finally:
+            if fr is not None:
+                fr.close()
+
+#Data collector crashed: backup cut off after a random line, no result.json
+def truncate_backup(folder: str, rng: random.Random):
+    path = os.path.join(folder, "backup.bak.txt")
+    with open(path, "r") as f:
+        lines = f.readlines()
+    with open(path, "w") as f:
+        f.writelines(lines[:rng.randint(3, len(lines) - 1)])
+
+#Backup that can not be rebuilt: a TRACE_LEAVE is missing, no result.json
+def corrupt_backup(folder: str, rng: random.Random):
+    path = os.path.join(folder, "backup.bak.txt")
+    with open(path, "r") as f:
+        lines = f.readlines()
+    leaves = [i for i, line in enumerate(lines[:-1]) if '"TRACE_LEAVE"' in line]
+    del lines[rng.choice(leaves)]
+    with open(path, "w") as f:
+        f.writelines(lines)
+
+def write_photo(photos_dir: str, fn: str, rng: random.Random):
+    from PIL import Image
+
+    path = os.path.join(photos_dir, path_tools.get_photo_dir(fn))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image = Image.new("RGB", (1600, 1200), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    image.save(path, quality=90)
+
+def generate_fleet(out_dir: str, plugs: int, experiments: int = 2, seed: int = 0,
+        crashed: float = 0.05, corrupted: float = 0.01, payload_bytes: int = 0, photos: int = 0):
+    rng = random.Random(seed)
+    charger_dir = os.path.join(out_dir, "chargers")
+    metadata_dir = os.path.join(out_dir, "metadata")
+    photos_dir = os.path.join(out_dir, "photos")
+    os.makedirs(metadata_dir, exist_ok=True)
+
+    parks: List[dict] = []
+    chargers: List[dict] = []
+    plug_rows: List[dict] = []
+
+    start = datetime.datetime(2023, 3, 1, 8, 0, 0)
+    photo_time = start
+
+    park_idx = 0
+    while len(plug_rows) < plugs:
+        park_idx += 1
+        country = rng.choice(COUNTRIES)
+        park_id = f"{country}.P{park_idx:05d}"
+
+        park_photos = []
+        for _ in range(photos):
+            photo_time += datetime.timedelta(minutes=rng.randint(1, 600))
+            fn = photo_time.strftime("%Y_%m_%d_%H_%M_%S") + ".jpg"
+            write_photo(photos_dir, fn, rng)
+            park_photos.append(fn)
+
+        parks.append({
+            "ID": park_id,
+            "Country": country, "Town": rng.choice(TOWNS),
+            "Type": rng.choice(PARK_TYPES), "Type2": rng.choice(PARK_TYPES2),
+            "Lat": str(round(rng.uniform(36, 70), 6)), "Long": str(round(rng.uniform(-10, 30), 6)),
+            "Photos": ", ".join(park_photos), "Notes": ""
+        })
+
+        manufacturer = rng.choice(MANUFACTURERS)
+        network = rng.choice(NETWORKS)
+        park_time = start + datetime.timedelta(days=rng.randint(0, 600), hours=rng.randint(0, 10))
+
+        for charger_idx in range(1, rng.randint(1, 6) + 1):
+            charger_id = f"{park_id}.C{charger_idx}"
+            mfg_year = rng.randint(2013, 2024) if rng.random() < 0.9 else None
+            profile = random_charger_profile(rng, country, mfg_year)
+
+            chargers.append({
+                "ID": charger_id,
+                "Position": str(charger_idx),
+                "Manufacturer": manufacturer, "Operator": network, "Model": f"{manufacturer[:3].upper()}-{rng.choice([50, 150, 300, 350])}",
+                "MFGYear": str(mfg_year) if mfg_year is not None else "", "MFGDetail": "",
+                "SN": f"SN{rng.randint(10**7, 10**8 - 1)}",
+                "Photos": "", "Notes": ""
+            })
+
+            for plug_idx in range(1, rng.randint(1, 2) + 1):
+                plug_id = f"{charger_id}.{plug_idx}"
+                plug_rows.append({"ID": plug_id, "Position": "Left" if plug_idx == 1 else "Right", "Notes": ""})
+
+                plug_path = os.path.join(charger_dir, path_tools.get_plug_folder(plug_id))
+                exp_time = park_time
+                for _ in range(experiments):
+                    #Repeats are mostly on the same visit, sometimes on a later one
+                    exp_time += datetime.timedelta(minutes=rng.randint(3, 20)) if rng.random() < 0.7 else datetime.timedelta(days=rng.randint(30, 200))
+                    folder = os.path.join(plug_path, exp_time.strftime("%Y_%m_%d_%H_%M_%S"))
+
+                    r = rng.random()
+                    failed = r < crashed + corrupted
+                    write_experiment(folder, rng, profile, exp_time, not failed, payload_bytes)
+                    if r < crashed:
+                        truncate_backup(folder, rng)
+                    elif failed:
+                        corrupt_backup(folder, rng)
+
+                if len(plug_rows) >= plugs:
+                    break
+            if len(plug_rows) >= plugs:
+                break
+
+    metadata.write_csv_to_dict(os.path.join(metadata_dir, "parks.csv"), parks)
+    metadata.write_csv_to_dict(os.path.join(metadata_dir, "chargers.csv"), chargers)
+    metadata.write_csv_to_dict(os.path.join(metadata_dir, "plugs.csv"), plug_rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset in the layout of data/")
+    parser.add_argument("out_dir", help="Data folder to create, use with EV_DATA_DIR=<out_dir>")
+    parser.add_argument("--plugs", type=int, default=10000)
+    parser.add_argument("--experiments", type=int, default=2, help="Experiments per plug")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--crashed", type=float, default=0.05, help="Fraction of experiments with a truncated backup and no result.json")
+    parser.add_argument("--corrupted", type=float, default=0.01, help="Fraction of experiments with a backup that can not be rebuilt")
+    parser.add_argument("--payload-bytes", type=int, default=0, help="Size of unused capture data in each experiment")
+    parser.add_argument("--photos", type=int, default=0, help="Photos per park")
+    args = parser.parse_args()
+
+    generate_fleet(args.out_dir, args.plugs, args.experiments, args.seed, args.crashed, args.corrupted, args.payload_bytes, args.photos)
+
+if __name__ == "__main__":
+    main()
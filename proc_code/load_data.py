@@ -4,11 +4,16 @@ Utilities for reading the result.json and backup.bak.txt files coming from the d
 
 
 from __future__ import annotations
-from typing import Any, List, Tuple, TypeVar, Dict
+from typing import Any, Collection, Iterable, List, Tuple, TypeVar, Dict
 
+import bisect
+import dataclasses
 from dataclasses import dataclass
+import fnmatch
 import glob
 import os
+import re
+import time
 from typing import Dict, List, NamedTuple
 import numpy as np
 import csv
@@ -16,10 +21,12 @@ import json
 
 from . import metadata
 from . import types
+from . import profiling
 from . import path_tools
 
 
 #Find all results nested inside data
+@profiling.span("find_experiment_folders")
 def find_experiment_folders(base: str):
     res = []
 
@@ -30,81 +37,174 @@ def find_experiment_folders(base: str):
                 
     return res
 
+#
+# Experiment discovery over the whole charger folder
+#
+
+#Bump when the layout of experiment_index.json changes
+EXPERIMENT_INDEX_VERSION = 1
+#Folders changed this recently may still change within the same mtime tick, they are listed again next time
+EXPERIMENT_INDEX_RACY_NS = 2 * 10**9
+
+#Plug ID -> experiment folders, once build_experiment_index has run. Otherwise each plug folder is walked on its own.
+experiment_index: Dict[str, List[str]] | None = None
+
+#Find all experiment folders below base in one pass, without descending into experiment folders.
+#min_depth: Only folders at least this many levels below base can be experiments
+#cache: Relative folder -> [mtime_ns, is experiment, subfolders] from a previous scan. Folders whose mtime did not change are not listed again.
+#Without a cache, folders are only listed, saving a stat of each.
+#Returns the experiment folders as (path relative to base with / separators, full path), and the cache for the next scan.
+def scan_experiment_tree(base: str, cache: Dict[str, Any] | None, min_depth: int = 0) -> Tuple[List[Tuple[str, str]], Dict[str, Any]]:
+    res: List[Tuple[str, str]] = []
+    new_cache: Dict[str, Any] = {}
+    now = time.time_ns()
+
+    stack = [("", base, 0)]
+    while len(stack) > 0:
+        rel, path, depth = stack.pop()
+        try:
+            mtime = os.stat(path).st_mtime_ns if cache is not None else None
+
+            entry = cache.get(rel) if cache is not None else None
+            if entry is None or entry[0] != mtime:
+                is_exp = False
+                subfolders: List[str] = []
+                with os.scandir(path) as it:
+                    for e in it:
+                        if e.name == "backup.bak.txt" and depth >= min_depth:
+                            is_exp = True
+                        elif e.is_dir():
+                            subfolders.append(e.name)
+                entry = [mtime if mtime is not None and now - mtime > EXPERIMENT_INDEX_RACY_NS else None, is_exp, [] if is_exp else sorted(subfolders)]
+        except FileNotFoundError:
+            continue
+        new_cache[rel] = entry
+
+        if entry[1]:
+            res.append((rel, path))
+        else:
+            prefix = rel + "/" if rel != "" else ""
+            for name in reversed(entry[2]):
+                stack.append((prefix + name, os.path.join(path, name), depth + 1))
+
+    return res, new_cache
+
+def read_experiment_index_cache() -> Dict[str, Any]:
+    try:
+        with open(path_tools.EXPERIMENT_INDEX_FILE, "r") as f:
+            j = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if j.get("version") != EXPERIMENT_INDEX_VERSION:
+        return {}
+    return j["folders"]
+
+def write_experiment_index_cache(cache: Dict[str, Any]):
+    tmp_path = path_tools.EXPERIMENT_INDEX_FILE + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump({"version": EXPERIMENT_INDEX_VERSION, "folders": cache}, f)
+        os.replace(tmp_path, path_tools.EXPERIMENT_INDEX_FILE)
+    except OSError:
+        #Read only data folder, the next scan will list every folder again
+        pass
+
+#Discover the experiments of all plugs, and use the result in read_plug_experiments from then on.
+#Experiment folders are mapped to plugs by the <country>/<park>/<charger>_<plug>/ part of their path.
+@profiling.span("experiment_index")
+def build_experiment_index(use_cache: bool = True) -> Dict[str, List[str]]:
+    cache = read_experiment_index_cache() if use_cache else None
+    #<country>/<park>/<charger>_<plug>/<timestamp>
+    folders, new_cache = scan_experiment_tree(path_tools.CHARGER_DIR, cache, 4)
+    if use_cache and new_cache != cache:
+        write_experiment_index_cache(new_cache)
+
+    index: Dict[str, List[str]] = {}
+    for rel, folder in folders:
+        index.setdefault(path_tools.get_plug_id_from_parts(rel.split("/")), []).append(folder)
+
+    use_experiment_index(index)
+    return index
+
+#Set the index, for worker processes. None to walk each plug folder instead.
+def use_experiment_index(index: Dict[str, List[str]] | None):
+    global experiment_index
+    experiment_index = index
+    plug_folder_mtimes.clear()
+
+#Plug ID -> mtime_ns of the plug folder when its entry in the index was last listed again
+plug_folder_mtimes: Dict[str, int] = {}
+
+#For long running processes: list the experiments of a plug again if its folder changed since the index was built,
+#as new experiments are added as subfolders of the plug folder
+def refresh_experiment_index(plug: types.Plug):
+    if experiment_index is None:
+        return
+    path = plug.get_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        experiment_index.pop(plug.id, None)
+        plug_folder_mtimes.pop(plug.id, None)
+        return
+    if plug_folder_mtimes.get(plug.id) == mtime:
+        return
+
+    #Same layout as build_experiment_index, <timestamp> below the plug folder
+    folders, _ = scan_experiment_tree(path, None, 1)
+    experiment_index[plug.id] = [folder for _, folder in folders]
+    #Like scan_experiment_tree, a folder changed within the same mtime tick is listed again next time
+    if time.time_ns() - mtime > EXPERIMENT_INDEX_RACY_NS:
+        plug_folder_mtimes[plug.id] = mtime
+    else:
+        plug_folder_mtimes.pop(plug.id, None)
+
+def plug_experiment_folders(plug: types.Plug) -> List[str]:
+    if experiment_index is not None:
+        return experiment_index.get(plug.id, [])
+    return find_experiment_folders(plug.get_path())
+
 #Link experiment folders to chargers
 def read_plug_experiments(plug: types.Plug):
 
     plug.experiments = []
-    for exp_folder in find_experiment_folders(plug.get_path()):
+    for exp_folder in plug_experiment_folders(plug):
         plug.experiments.append(types.Experiment(
             exp_folder,
             None, None,
             types.ExperimentResult()
         ))
 
-#Rebuild the result.json file from backup.bak.txt
-#If the data collector crashed before finishing
-def regenerate_result_json(folder) -> bool:
-    entries = []
-    with open(os.path.join(folder, "backup.bak.txt")) as fr:
-        for line in fr:
-            line = line.strip()
-            if len(line) > 0:
-                entries.append(json.loads(line))
-
-    trace = [{"trace": [], "data": []}]
-
-    for entry in entries:
-        if entry["type"] == "TRACE_ENTER":
-            new_elem = {
-                "version": entry["version"],
-                "type": "TRACE",
-                "trace": entry["trace"],
-                "start_time": entry["time"],
-                "end_time": None,
-                "data": []
-            }
-            if new_elem["trace"][:-1] != trace[-1]["trace"]:
-                print("Trace mismatch")
-                return False
-            
-            trace[-1]["data"].append(new_elem)
-            trace.append(new_elem)
-
-        elif entry["type"] == "TRACE_LEAVE":
-            if entry["trace"] != trace[-1]["trace"]:
-                print("Trace mismatch")
-                return False
-            
-            trace[-1]["end_time"] = entry["time"]
-            trace = trace[:-1]
-
-        else:
-            new_elem = {
-                "version": entry["version"],
-                "type": "ENTRY",
-                "trace": entry["trace"],
-                "time": entry["time"],
-                "data_type": entry["type"],
-                "data": entry["data"]
-            }
-            if new_elem["trace"] != trace[-1]["trace"]:
-                print("Trace mismatch")
-                return False
-            
-            trace[-1]["data"].append(new_elem)
-
-    with open(os.path.join(folder, "result.json"), "w") as fw:
-        json.dump(trace[0]["data"][0], fw, indent = 2)
-
-    return True
-
 class DataEntry(NamedTuple):
     name: str
     trace: List[str]
     
     time: str
     data: Any
-class TraceEntry(NamedTuple):
+#Positions of the children of a TraceEntry, split by kind and by name. Position lists are sorted.
+class TraceIndex(NamedTuple):
+    size: int
+
+    data: List[int]
+    traces: List[int]
+
+    data_by_name: Dict[str, List[int]]
+    traces_by_name: Dict[str, List[int]]
+
+    @staticmethod
+    def build(content: List[TraceEntry | DataEntry]) -> TraceIndex:
+        res = TraceIndex(len(content), [], [], {}, {})
+        for i, v in enumerate(content):
+            if isinstance(v, DataEntry):
+                res.data.append(i)
+                res.data_by_name.setdefault(v.name, []).append(i)
+            else:
+                res.traces.append(i)
+                res.traces_by_name.setdefault(v.name, []).append(i)
+        return res
+
+@dataclass
+class TraceEntry:
     name: str
     trace: List[str]
 
@@ -112,12 +212,25 @@ class TraceEntry(NamedTuple):
     start_time: str
     end_time: str
 
+    #Built lazily on the first lookup, and rebuilt if content was appended to since
+    index: TraceIndex | None = dataclasses.field(default=None, repr=False, compare=False)
+
+    def get_index(self) -> TraceIndex:
+        if self.index is None or self.index.size != len(self.content):
+            self.index = TraceIndex.build(self.content)
+        return self.index
+
+    def select(self, positions: List[int], after: int) -> List[Tuple[int, Any]]:
+        return [(i, self.content[i]) for i in positions[bisect.bisect_right(positions, after):]]
+
     def find_data(self, type: str, after: int = -1) -> List[Tuple[int, DataEntry]]:
-        return [(i, v) for i, v in enumerate(self.content) if isinstance(v, DataEntry) and v.name == type and i > after]
+        return self.select(self.get_index().data_by_name.get(type, []), after)
+    def find_traces(self, name: str, after: int = -1) -> List[Tuple[int, TraceEntry]]:
+        return self.select(self.get_index().traces_by_name.get(name, []), after)
     def entries(self, after: int = -1) -> List[Tuple[int, DataEntry]]:
-        return [(i, v) for i, v in enumerate(self.content) if isinstance(v, DataEntry) and i > after]
+        return self.select(self.get_index().data, after)
     def traces(self, after: int = -1) -> List[Tuple[int, TraceEntry]]:
-        return [(i, v) for i, v in enumerate(self.content) if isinstance(v, TraceEntry) and i > after]
+        return self.select(self.get_index().traces, after)
 
 def parse_dataentry(j: Any) -> DataEntry:
     return DataEntry(
@@ -148,12 +261,29 @@ def parse_entry(j: Any) -> DataEntry | TraceEntry:
         return parse_dataentry(j)
     raise ValueError(j["type"])
 
-def try_read_result(folder) -> TraceEntry | None:
+#
+# Selective parsing of result.json
+#
+
+#Compile fnmatch style name patterns ("SDP_*") into one regex
+def compile_name_patterns(patterns: Iterable[str]) -> re.Pattern:
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
+
+#Name of an undecoded trace or entry, as parse_entry would give it
+def entry_name(j: Any) -> str:
+    return j["trace"][-1] if j["type"] == "TRACE" else j["data_type"]
+
+#wanted: Name patterns of the top level traces and entries to keep, None to keep all
+def try_read_result(folder, wanted: Collection[str] | None = None) -> TraceEntry | None:
     result_file_path = os.path.join(folder, "result.json")
     if os.path.isfile(result_file_path):
         with open(result_file_path) as f:
             try:
                 root_trace = json.load(f)
+                #Unwanted elements are dropped before they are converted to entries
+                if wanted is not None:
+                    wanted_re = compile_name_patterns(wanted)
+                    root_trace["data"] = [j for j in root_trace["data"] if wanted_re.fullmatch(entry_name(j))]
                 return parse_trace(root_trace)
             except Exception as e:
                 print("Corrupted " + result_file_path)
@@ -162,13 +292,163 @@ def try_read_result(folder) -> TraceEntry | None:
     else:
         print("Not found " + folder)
 
-def read_result(folder) -> TraceEntry | None:
-    res = try_read_result(folder)
+#Writes result.json incrementally while backup.bak.txt is streamed, in the same layout the data collector uses
+class ResultJsonWriter():
+    def __init__(self, f):
+        self.f = f
+        #One flag per open "data" list, whether no element was written into it yet
+        self.first: List[bool] = [True]
+        #Like the data collector, only the first top level element is kept
+        self.done = False
+
+    def begin_element(self) -> bool:
+        if len(self.first) == 1:
+            if self.done:
+                return False
+            self.done = True
+        if not self.first[-1]:
+            self.f.write(",")
+        self.first[-1] = False
+        return True
+
+    def enter(self, entry: Any):
+        if self.begin_element():
+            self.f.write(f"{{\"version\": {json.dumps(entry['version'])}, \"type\": \"TRACE\", \"trace\": {json.dumps(entry['trace'])}, \"start_time\": {json.dumps(entry['time'])}, \"data\": [")
+            self.first.append(True)
+
+    def leave(self, time: str | None):
+        if len(self.first) > 1:
+            self.f.write(f"], \"end_time\": {json.dumps(time)}}}")
+            self.first.pop()
+
+    def entry(self, entry: Any):
+        if self.begin_element():
+            json.dump({
+                "version": entry["version"],
+                "type": "ENTRY",
+                "trace": entry["trace"],
+                "time": entry["time"],
+                "data_type": entry["type"],
+                "data": entry["data"]
+            }, self.f)
+
+    #Close any traces left open by a crashed data collector
+    def close(self):
+        while len(self.first) > 1:
+            self.leave(None)
+
+#Read backup.bak.txt line by line, directly into TraceEntry/DataEntry objects
+#If write_result_json is set, result.json is rebuilt as a side effect, for when the data collector crashed before finishing
+#wanted: Name patterns of the top level traces and entries to keep, None to keep all. result.json is always written in full.
+@profiling.span("read_backup")
+def read_backup(folder: str, write_result_json: bool = False, wanted: Collection[str] | None = None) -> TraceEntry | None:
+    result_file_path = os.path.join(folder, "result.json")
+    tmp_file_path = result_file_path + ".tmp"
+
+    wanted_re = compile_name_patterns(wanted) if wanted is not None else None
+
+    root = TraceEntry(name = "", trace = [], content = [], start_time = "", end_time = "")
+    stack: List[TraceEntry] = [root]
+    #Stack depth of a top level trace that is not wanted, nothing below it is kept
+    pruned_depth: int | None = None
+
+    writer: ResultJsonWriter | None = None
+    fw = open(tmp_file_path, "w") if write_result_json else None
+    try:
+        if fw is not None:
+            writer = ResultJsonWriter(fw)
+
+        with open(os.path.join(folder, "backup.bak.txt")) as fr:
+            for line in fr:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                entry = json.loads(line)
+
+                if entry["type"] == "TRACE_ENTER":
+                    if entry["version"] != 1:
+                        raise ValueError("Unknown entry version")
+                    if entry["trace"][:-1] != stack[-1].trace:
+                        print("Trace mismatch")
+                        return None
+
+                    #end_time matches parse_trace
+                    new_trace = TraceEntry(
+                        name = entry["trace"][-1],
+                        trace = entry["trace"],
+                        content = [],
+                        start_time = entry["time"],
+                        end_time = entry["time"]
+                    )
+                    if pruned_depth is None and len(stack) == 2 and wanted_re is not None and not wanted_re.fullmatch(new_trace.name):
+                        pruned_depth = len(stack)
+                    if pruned_depth is None:
+                        stack[-1].content.append(new_trace)
+                    stack.append(new_trace)
+                    if writer is not None:
+                        writer.enter(entry)
+
+                elif entry["type"] == "TRACE_LEAVE":
+                    if entry["trace"] != stack[-1].trace:
+                        print("Trace mismatch")
+                        return None
+
+                    stack.pop()
+                    if pruned_depth is not None and len(stack) <= pruned_depth:
+                        pruned_depth = None
+                    if writer is not None:
+                        writer.leave(entry["time"])
+
+                else:
+                    if entry["version"] != 1:
+                        raise ValueError("Unknown entry version")
+                    if entry["trace"] != stack[-1].trace:
+                        print("Trace mismatch")
+                        return None
+
+                    keep = pruned_depth is None
+                    if len(stack) == 2 and wanted_re is not None and not wanted_re.fullmatch(entry["type"]):
+                        keep = False
+                    if keep:
+                        stack[-1].content.append(DataEntry(
+                            name = entry["type"],
+                            trace = entry["trace"],
+                            time = entry["time"],
+                            data = entry["data"]
+                        ))
+                    if writer is not None:
+                        writer.entry(entry)
+
+        if len(root.content) == 0 or not isinstance(root.content[0], TraceEntry):
+            print("No root trace")
+            return None
+
+        if fw is not None and writer is not None:
+            writer.close()
+            fw.close()
+            os.replace(tmp_file_path, result_file_path)
+            fw = None
+
+        return root.content[0]
+    finally:
+        if fw is not None:
+            fw.close()
+            os.remove(tmp_file_path)
+
+#Rebuild the result.json file from backup.bak.txt
+#If the data collector crashed before finishing
+def regenerate_result_json(folder) -> bool:
+    return read_backup(folder, write_result_json = True) is not None
+
+#write_regenerated: Keep a result.json rebuilt from the backup, so it does not need to be rebuilt next time
+#wanted: Name patterns of the top level traces and entries to keep, None to keep all
+@profiling.span("read_result")
+def read_result(folder, write_regenerated: bool = True, wanted: Collection[str] | None = None) -> TraceEntry | None:
+    res = try_read_result(folder, wanted)
     if res is not None:
         return res
 
-    if not regenerate_result_json(folder):
+    res = read_backup(folder, write_result_json = write_regenerated, wanted = wanted)
+    if res is None:
         print("Failed to regenerate " + folder)
-        return None
-
-    return try_read_result(folder)
+    return res
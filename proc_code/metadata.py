@@ -40,11 +40,14 @@ def read_csv_to_dict(file_path: str, **reader_args):
 def write_csv_to_dict(file_path: str, data: List[Dict[str, Any]], **writer_args):
     cols = data[0].keys()
 
-    with open(file_path, mode='w', newline='', encoding='utf-8') as csvfile:
+    #Written next to the table and moved over it, so a crash never leaves a partial table
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, mode='w', newline='', encoding='utf-8') as csvfile:
         csv_writer = csv.DictWriter(csvfile, fieldnames=cols, **writer_args)
         
         csv_writer.writeheader()
         csv_writer.writerows(data)
+    os.replace(tmp_path, file_path)
 
 # Read tables containing experiment metadata
 def read_charger_metadata_table() -> Metadata:
@@ -58,30 +61,47 @@ def read_charger_metadata_table() -> Metadata:
 
     return Metadata(parks_dict, chargers_dict, plugs_dict)
 
-def save_charger_metadata_table(meta: Metadata):
-    parks_data_dict = [{
+def park_row(park: types.Park) -> Dict[str, str]:
+    return {
         "ID": park.id,
         "Country": park.country, "Town": park.town,
         "Type": park.type, "Type2": park.type2,
         "Lat": str(park.lat), "Long": str(park.long),
         "Photos": park.photos, "Notes": park.notes
-    } for park in meta.parks.values()]
+    }
 
-    chargers_data_dict = [{
+def charger_row(charger: types.Charger) -> Dict[str, str]:
+    return {
         "ID": charger.id,
         "Position": charger.position,
         "Manufacturer": charger.manufacturer, "Operator": charger.network, "Model": charger.model,
         "MFGYear": str(charger.mfg_year) if charger.mfg_year is not None else "", "MFGDetail": charger.mfg_detail,
         "SN": charger.sn,
         "Photos": charger.photos, "Notes": charger.notes
-    } for charger in meta.chargers.values()]
+    }
 
-    plugs_data_dict = [{
+def plug_row(plug: types.Plug) -> Dict[str, str]:
+    return {
         "ID": plug.id,
         "Position": plug.position,
         "Notes": plug.notes
-    } for plug in meta.plugs.values()]
-
-    write_csv_to_dict(os.path.join(path_tools.METADATA_DIR, "parks.csv"), parks_data_dict)
-    write_csv_to_dict(os.path.join(path_tools.METADATA_DIR, "chargers.csv"), chargers_data_dict)
-    write_csv_to_dict(os.path.join(path_tools.METADATA_DIR, "plugs.csv"), plugs_data_dict)
+    }
+
+#Write the tables and clear the metadata_dirty flags. With only_dirty, tables without a changed object are skipped.
+#Returns the number of tables written.
+def save_charger_metadata_table(meta: Metadata, only_dirty: bool = False) -> int:
+    tables: List[Tuple[str, Dict[str, Any], Any]] = [
+        ("parks.csv", meta.parks, park_row),
+        ("chargers.csv", meta.chargers, charger_row),
+        ("plugs.csv", meta.plugs, plug_row),
+    ]
+
+    written = 0
+    for fn, objs, to_row in tables:
+        if only_dirty and not any(obj.metadata_dirty for obj in objs.values()):
+            continue
+        write_csv_to_dict(os.path.join(path_tools.METADATA_DIR, fn), [to_row(obj) for obj in objs.values()])
+        for obj in objs.values():
+            obj.metadata_dirty = False
+        written += 1
+    return written
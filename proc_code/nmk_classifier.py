@@ -0,0 +1,112 @@
+"""
+Automatic classification of SLAC NMKs as pattern, partial or random.
+All NMKs are scored together in NumPy, proposing the same 0/1/2 verdicts as the manual review, with a confidence.
+"""
+
+from __future__ import annotations
+
+from typing import List, NamedTuple
+
+import numpy as np
+
+NMK_LEN = 16
+
+# Entropy of the byte values in an NMK, in bits. With 16 bytes it is at most 4.
+# Random keys almost always have 4 or less than 3 repeated bytes, >= 3.625
+ENTROPY_RANDOM = 3.6
+ENTROPY_PATTERN = 2.0
+# Fraction of neighbouring nibbles that are equal. Random: 1/16
+REPEAT_RANDOM = 0.25
+REPEAT_PATTERN = 0.6
+# Fraction of bytes continuing a constant step from the previous ones. Random: 1/256
+ARITHMETIC_RANDOM = 0.2
+ARITHMETIC_PATTERN = 0.8
+
+class NMKScores(NamedTuple):
+    nmks: List[str]
+
+    entropy: np.ndarray
+    repeat: np.ndarray
+    arithmetic: np.ndarray
+    #Number of times the NMK was seen, and in how many different plugs
+    reuse_count: np.ndarray
+    reuse_plugs: np.ndarray
+
+    #0: Pattern, 1: Partial, 2: Random
+    verdict: np.ndarray
+    confidence: np.ndarray
+
+def nmk_matrix(nmks: List[str]) -> np.ndarray:
+    for nmk in nmks:
+        if len(nmk) != 2 * NMK_LEN:
+            raise ValueError(f"Invalid NMK {nmk}")
+    return np.frombuffer(bytes.fromhex("".join(nmks)), dtype=np.uint8).reshape(len(nmks), NMK_LEN)
+
+def byte_entropy(b: np.ndarray) -> np.ndarray:
+    #Count of each byte value, at the position of every byte
+    counts = (b[:, :, None] == b[:, None, :]).sum(axis=2)
+    return -np.log2(counts / b.shape[1]).mean(axis=1)
+
+def repeated_nibbles(b: np.ndarray) -> np.ndarray:
+    nibbles = np.stack([b >> 4, b & 0xF], axis=2).reshape(b.shape[0], -1)
+    return (nibbles[:, 1:] == nibbles[:, :-1]).mean(axis=1)
+
+#Constant steps between bytes, or between every other byte for interleaved sequences
+def arithmetic_sequence(b: np.ndarray) -> np.ndarray:
+    res = np.zeros(b.shape[0])
+    for lag in [1, 2]:
+        steps = (b[:, lag:].astype(np.int16) - b[:, :-lag]) % 256
+        res = np.maximum(res, (steps[:, 1:] == steps[:, :-1]).mean(axis=1))
+    return res
+
+def reuse(b: np.ndarray, plug_ids: List[str]):
+    _, nmk_idx, nmk_counts = np.unique(b, axis=0, return_inverse=True, return_counts=True)
+    nmk_idx = nmk_idx.reshape(-1)
+    _, plug_idx = np.unique(np.array(plug_ids), return_inverse=True)
+
+    pairs = np.unique(np.stack([nmk_idx, plug_idx.reshape(-1)], axis=1), axis=0)
+    plugs_per_nmk = np.bincount(pairs[:, 0], minlength=len(nmk_counts))
+    return nmk_counts[nmk_idx], plugs_per_nmk[nmk_idx]
+
+def margin(x: np.ndarray, scale: float) -> np.ndarray:
+    return np.clip(x / scale, 0, 1)
+
+#plug_ids: Plug each NMK was seen in, one entry per observation. NMKs may repeat.
+def classify_nmks(nmks: List[str], plug_ids: List[str]) -> NMKScores:
+    b = nmk_matrix(nmks)
+
+    entropy = byte_entropy(b)
+    repeat = repeated_nibbles(b)
+    arithmetic = arithmetic_sequence(b)
+    reuse_count, reuse_plugs = reuse(b, plug_ids)
+
+    is_pattern = (entropy <= ENTROPY_PATTERN) | (repeat >= REPEAT_PATTERN) | (arithmetic >= ARITHMETIC_PATTERN) | (reuse_plugs > 1)
+    is_random = ~is_pattern & (entropy >= ENTROPY_RANDOM) & (repeat <= REPEAT_RANDOM) & (arithmetic <= ARITHMETIC_RANDOM)
+    verdict = np.where(is_pattern, 0, np.where(is_random, 2, 1)).astype(np.int8)
+
+    pattern_confidence = np.maximum.reduce([
+        margin(ENTROPY_PATTERN - entropy, 1.0),
+        margin(repeat - REPEAT_PATTERN, 0.2),
+        margin(arithmetic - ARITHMETIC_PATTERN, 0.2),
+        (reuse_plugs > 1).astype(float),
+    ])
+    random_confidence = np.minimum.reduce([
+        margin(entropy - ENTROPY_RANDOM, 0.3),
+        margin(REPEAT_RANDOM - repeat, 0.2),
+        margin(ARITHMETIC_RANDOM - arithmetic, 0.15),
+    ])
+    #A key repeated between experiments of one plug may be static, leave it to a human
+    random_confidence = np.where(reuse_count > 1, random_confidence * 0.5, random_confidence)
+    #Partial patterns are always left to a human
+    confidence = np.where(is_pattern, pattern_confidence, np.where(is_random, random_confidence, 0.5))
+
+    return NMKScores(
+        nmks = nmks,
+        entropy = entropy,
+        repeat = repeat,
+        arithmetic = arithmetic,
+        reuse_count = reuse_count,
+        reuse_plugs = reuse_plugs,
+        verdict = verdict,
+        confidence = confidence,
+    )
@@ -4,13 +4,31 @@ All relative to the location of this file.
 """
 
 import os
+from typing import List
 
 REPO_BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
 
-DATA_BASE_DIR = os.path.join(REPO_BASE_DIR, "data")
+#EV_DATA_DIR can point to another data folder, such as a generated dataset
+DATA_BASE_DIR = os.environ.get("EV_DATA_DIR", os.path.join(REPO_BASE_DIR, "data"))
 CHARGER_DIR = os.path.join(DATA_BASE_DIR, "chargers")
 PHOTOS_DIR = os.path.join(DATA_BASE_DIR, "photos")
+#Resized photos made by the webserver, can be deleted at any time
+THUMBS_CACHE_DIR = os.path.join(DATA_BASE_DIR, "thumbs_cache")
 METADATA_DIR = os.path.join(DATA_BASE_DIR, "metadata")
+NMK_REVIEW_QUEUE_FILE = os.path.join(DATA_BASE_DIR, "nmk_review_queue.json")
+EXPERIMENT_INDEX_FILE = os.path.join(DATA_BASE_DIR, "experiment_index.json")
+
+#Switch to another data folder at runtime. Also applies to worker processes started afterwards.
+def set_data_dir(path: str):
+    global DATA_BASE_DIR, CHARGER_DIR, PHOTOS_DIR, THUMBS_CACHE_DIR, METADATA_DIR, NMK_REVIEW_QUEUE_FILE, EXPERIMENT_INDEX_FILE
+    os.environ["EV_DATA_DIR"] = os.path.abspath(path)
+    DATA_BASE_DIR = os.environ["EV_DATA_DIR"]
+    CHARGER_DIR = os.path.join(DATA_BASE_DIR, "chargers")
+    PHOTOS_DIR = os.path.join(DATA_BASE_DIR, "photos")
+    THUMBS_CACHE_DIR = os.path.join(DATA_BASE_DIR, "thumbs_cache")
+    METADATA_DIR = os.path.join(DATA_BASE_DIR, "metadata")
+    NMK_REVIEW_QUEUE_FILE = os.path.join(DATA_BASE_DIR, "nmk_review_queue.json")
+    EXPERIMENT_INDEX_FILE = os.path.join(DATA_BASE_DIR, "experiment_index.json")
 
 def get_plug_folder(id: str):
     return os.path.join(*id.split(".", 2)).replace(".", "_")
@@ -18,5 +36,13 @@ def get_plug_folder(id: str):
 def get_plug_path(id: str):
     return os.path.join(CHARGER_DIR, get_plug_folder(id))
 
+#Inverse of get_plug_folder, for any path inside of a plug folder
+def get_plug_id(path: str):
+    return get_plug_id_from_parts(os.path.relpath(path, CHARGER_DIR).split(os.sep))
+
+#Same, from the folder names below CHARGER_DIR
+def get_plug_id_from_parts(parts: List[str]):
+    return ".".join(parts[:2] + [parts[2].replace("_", ".")])
+
 def get_photo_dir(fn: str):
     return '_'.join(fn.split('_')[:3]) + "/" + fn.rstrip() #Also used by webserver
\ No newline at end of file
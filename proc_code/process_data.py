@@ -1,58 +1,136 @@
 from __future__ import annotations
 
+import argparse
 import datetime
 import os
 import json
 
+import contextlib
 import csv
-from typing import List
+import fnmatch
+import multiprocessing
+import re
+from typing import Any, Callable, Dict, Iterable, List, Tuple
 
 from . import metadata
 from . import path_tools
 from . import load_data, types
+from . import confidence
+from . import fingerprint
+from . import fleet_table
+from . import profiling
+from .result_store import ResultStore, to_key
 from .nid import to_nid
 
-from .utils import parse_float, parse_int, count_elements, verdict_bool, verdict_int, vertict_val
+from .utils import parse_float, parse_int, verdict_bool, verdict_int, vertict_val
+
+#Bump when a change to the processing changes its results, this invalidates all processed.json and overview.json files
+PROCESSOR_VERSION = 1
+
+# Trace handlers
+
+#Handlers are registered for a path of trace and entry names below the root trace, with an fnmatch pattern per level, such as "SDP_*/SDP/RES".
+#process_experiment walks result.json once, calling them in document order with the experiment, the matching trace or entry, and the traces above it.
+TraceHandler = Callable[[types.Experiment, Any, List[load_data.TraceEntry]], None]
+
+#(pattern, compiled levels, for traces or entries, handler)
+trace_handlers: List[Tuple[str, List[re.Pattern], bool, TraceHandler]] = []
+#Path -> (handlers of a trace there, handlers of an entry there, whether any handler is further down)
+handler_lookup_cache: Dict[Tuple[str, ...], Tuple[List[TraceHandler], List[TraceHandler], bool]] = {}
+
+def register_handler(patterns: Iterable[str], is_trace: bool, fn: TraceHandler):
+    for pattern in patterns:
+        trace_handlers.append((pattern, [re.compile(fnmatch.translate(p)) for p in pattern.split("/")], is_trace, fn))
+    handler_lookup_cache.clear()
+
+def on_trace(*patterns: str):
+    def decorator(fn: TraceHandler) -> TraceHandler:
+        register_handler(patterns, True, fn)
+        return fn
+    return decorator
+
+def on_entry(*patterns: str):
+    def decorator(fn: TraceHandler) -> TraceHandler:
+        register_handler(patterns, False, fn)
+        return fn
+    return decorator
+
+def lookup_handlers(path: Tuple[str, ...]) -> Tuple[List[TraceHandler], List[TraceHandler], bool]:
+    res = handler_lookup_cache.get(path)
+    if res is None:
+        on_trace_here: List[TraceHandler] = []
+        on_entry_here: List[TraceHandler] = []
+        descend = False
+        for _, levels, is_trace, fn in trace_handlers:
+            if len(levels) < len(path) or not all(level.match(name) for level, name in zip(levels, path)):
+                continue
+            if len(levels) > len(path):
+                descend = True
+            elif is_trace:
+                on_trace_here.append(fn)
+            else:
+                on_entry_here.append(fn)
+        res = (on_trace_here, on_entry_here, descend)
+        handler_lookup_cache[path] = res
+    return res
 
+#Only descends into traces that have handlers further down
+def dispatch_trace(exp: types.Experiment, trace: load_data.TraceEntry, path: Tuple[str, ...], parents: List[load_data.TraceEntry]):
+    for child in trace.content:
+        child_path = path + (child.name,)
+        on_trace_here, on_entry_here, descend = lookup_handlers(child_path)
+        if isinstance(child, load_data.TraceEntry):
+            for fn in on_trace_here:
+                fn(exp, child, parents)
+            if descend:
+                dispatch_trace(exp, child, child_path, parents + [child])
+        else:
+            for fn in on_entry_here:
+                fn(exp, child, parents)
+
+#Top level traces and entries of result.json used by process_experiment, everything else is skipped when loading
+def processed_traces() -> List[str]:
+    res = ["INFO"]
+    for pattern, _, _, _ in trace_handlers:
+        top = pattern.split("/")[0]
+        if top not in res:
+            res.append(top)
+    return res
 
-def process_supported(exp: types.Experiment, supported_trace: load_data.TraceEntry):
-    parts = supported_trace.name.split("_")
+@on_entry("SUPPORTED_*/supportedAppProtocolRes/DECODED", "SUPPORTED_*/supportedAppProtocolRes/CHOSEN")
+@profiling.span("process_supported")
+def process_supported(exp: types.Experiment, entry: load_data.DataEntry, parents: List[load_data.TraceEntry]):
+    supp_type = parents[0].name.split("_")[-1]
 
-    conn_type = "_".join(parts[1:-1])
-    supp_type = parts[-1]
+    if entry.name == "DECODED":
+        if "<ResponseCode>Failed_NoNegotiation</ResponseCode>" in entry.data:
+            selected = None
+        else:
+            return
+    else:
+        selected = entry.data["name"]
+
+    if supp_type == "ALL":
+        if selected is not None:
+            exp.results.support_results.preferred.append(selected)
+            supp_type = selected
+
+    if supp_type == "DIN":
+        exp.results.support_results.din.append(selected)
+    elif supp_type == "V2V10":
+        exp.results.support_results.v2v10.append(selected)
+    elif supp_type == "V2V13":
+        exp.results.support_results.v2v13.append(selected)
+    elif supp_type == "V20DC":
+        exp.results.support_results.v20dc.append(selected)
 
-    def set_result(supp_type, selected):
-        if supp_type == "ALL":
-            if selected is not None:
-                exp.results.support_results.preferred.append(selected)
-                supp_type = selected
+    else:
+        print(f"Unknown type {supp_type} in {exp.path}")
 
-        if supp_type == "DIN":
-            exp.results.support_results.din.append(selected)
-        elif supp_type == "V2V10":
-            exp.results.support_results.v2v10.append(selected)
-        elif supp_type == "V2V13":
-            exp.results.support_results.v2v13.append(selected)
-        elif supp_type == "V20DC":
-            exp.results.support_results.v20dc.append(selected)
-
-        else:
-            print(f"Unknown type {supp_type} in {exp.path}")
-
-    for _, entry in supported_trace.traces():
-        if entry.name == "supportedAppProtocolRes":
-            for _, entry2 in entry.entries():
-                if entry2.name == "DECODED":
-                    if "<ResponseCode>Failed_NoNegotiation</ResponseCode>" in entry2.data:
-                        set_result(supp_type, None)
-                if entry2.name == "CHOSEN":
-                    set_result(supp_type, entry2.data["name"])           
-
-def process_conn_inner(exp: types.Experiment, conn_trace: load_data.TraceEntry):
-    good = True
-    for _, entry in conn_trace.entries():
-        if entry.name == "EXCEPTION":
-            good = False
+@on_trace("CONN_*/NTLS", "CONN_*/UTLS", "CONN_*/MTLS")
+@profiling.span("process_conn")
+def process_conn(exp: types.Experiment, conn_trace: load_data.TraceEntry, parents: List[load_data.TraceEntry]):
+    good = len(conn_trace.find_data("EXCEPTION")) == 0
 
     if exp.version is None:
         raise ValueError("Version not set")
@@ -74,160 +152,240 @@ def process_conn_inner(exp: types.Experiment, conn_trace: load_data.TraceEntry):
     else:
         print(f"Unknown connection type {conn_type}")
 
-def process_conn(exp: types.Experiment, conn_trace: load_data.TraceEntry):
-    for _, entry in conn_trace.traces():
-        if entry.name == "NTLS":
-            process_conn_inner(exp, entry)
-        if entry.name == "UTLS":
-            process_conn_inner(exp, entry)
-        if entry.name == "MTLS":
-            process_conn_inner(exp, entry)
-
-def process_sdp_inner(exp: types.Experiment, sdp_trace: load_data.TraceEntry, tls: bool):
-    for _, entry in sdp_trace.entries():
-        if entry.name == "RES":
-            exp.results.sdp_results.append(types.SDPResult(
-                req_tls = tls,
-                res_tls = entry.data["res"]["tls"],
-                port = entry.data["res"]["port"],
-            ))
-
-def process_sdp(exp: types.Experiment, sdp_trace: load_data.TraceEntry):
-    for _, entry in sdp_trace.traces():
-        if entry.name == "SDP":
-            process_sdp_inner(exp, entry, sdp_trace.name.endswith("YTLS"))
-
-def process_slac(exp: types.Experiment, slac_trace: load_data.TraceEntry):
-    for _, entry in slac_trace.entries():
-        if entry.name == "SLAC":
-            #Fix bugs in early data collectors
-            if entry.data["EVSE_ID"] == entry.data["EVSE_MAC"]:
-                entry.data["EVSE_ID"] = ""
-            if entry.data["EVSE_MAC"] == entry.data["PEV_MAC"]:
-                entry.data["EVSE_MAC"] = ""
-
-            if entry.data["NMK"] is not None:
-                exp.results.slac_nmk.append(
-                    types.SlacNMKResult(
-                        nmk = entry.data["NMK"],
-                        nid = entry.data["NID"],
-                        nid_match= (bytes.fromhex(entry.data["NID"]) == to_nid(bytes.fromhex(entry.data["NMK"]))),
-                        random = None
-                    )
-                )
-            if entry.data["AAG"] is not None:
-                exp.results.slac_ids.append(
-                    types.SlacSoundingResult(
-                        evse_id= entry.data["EVSE_ID"],
-                        evse_mac= entry.data["EVSE_MAC"],
-                        aag= entry.data["AAG"]
+@on_entry("SDP_*/SDP/RES")
+@profiling.span("process_sdp")
+def process_sdp(exp: types.Experiment, entry: load_data.DataEntry, parents: List[load_data.TraceEntry]):
+    exp.results.sdp_results.append(types.SDPResult(
+        req_tls = parents[0].name.endswith("YTLS"),
+        res_tls = entry.data["res"]["tls"],
+        port = entry.data["res"]["port"],
+    ))
+
+@on_entry("SLAC/SLAC")
+@profiling.span("process_slac")
+def process_slac(exp: types.Experiment, entry: load_data.DataEntry, parents: List[load_data.TraceEntry]):
+    #Fix bugs in early data collectors
+    if entry.data["EVSE_ID"] == entry.data["EVSE_MAC"]:
+        entry.data["EVSE_ID"] = ""
+    if entry.data["EVSE_MAC"] == entry.data["PEV_MAC"]:
+        entry.data["EVSE_MAC"] = ""
+
+    if entry.data["NMK"] is not None:
+        exp.results.slac_nmk.append(
+            types.SlacNMKResult(
+                nmk = entry.data["NMK"],
+                nid = entry.data["NID"],
+                nid_match= (bytes.fromhex(entry.data["NID"]) == to_nid(bytes.fromhex(entry.data["NMK"]))),
+                random = None
+            )
+        )
+    if entry.data["AAG"] is not None:
+        exp.results.slac_ids.append(
+            types.SlacSoundingResult(
+                evse_id= entry.data["EVSE_ID"],
+                evse_mac= entry.data["EVSE_MAC"],
+                aag= entry.data["AAG"]
+            )
+        )
+
+@on_entry("SLAC/NETWORK")
+@profiling.span("process_slac")
+def process_network(exp: types.Experiment, entry: load_data.DataEntry, parents: List[load_data.TraceEntry]):
+    if entry.data is not None:
+        for sta in entry.data["STATIONS"]:
+            if sta["MAC"] == entry.data["CCO_DA"]:
+                exp.results.hpgp.append(
+                    types.HPGPCCoResult(
+                        mac = sta["MAC"],
+                        ident = sta["VERSION"]["IDENT"] if sta["VERSION"] is not None else "",
+                        version = sta["VERSION"]["VERSION"] if sta["VERSION"] is not None else "",
+                        mfg = sta["IDENTITY"]["MFG"] if sta["IDENTITY"] is not None else "",
+                        usr = sta["IDENTITY"]["USR"] if sta["IDENTITY"] is not None else "",
                     )
                 )
-            
-
-        if entry.name == "NETWORK":
-            if entry.data is not None:
-                for sta in entry.data["STATIONS"]:
-                    if sta["MAC"] == entry.data["CCO_DA"]:
-                        exp.results.hpgp.append(
-                            types.HPGPCCoResult(
-                                mac = sta["MAC"],
-                                ident = sta["VERSION"]["IDENT"] if sta["VERSION"] is not None else "",
-                                version = sta["VERSION"]["VERSION"] if sta["VERSION"] is not None else "",
-                                mfg = sta["IDENTITY"]["MFG"] if sta["IDENTITY"] is not None else "",
-                                usr = sta["IDENTITY"]["USR"] if sta["IDENTITY"] is not None else "",
-                            )
-                        )
 
 # Experiment
 
-def load_experiment(exp: types.Experiment) -> bool:
+@profiling.span("nmk_review")
+def read_nmk_review(plug: types.Plug) -> Dict[str, int]:
+    review_path = os.path.join(plug.get_path(), "nmk_review.json")
+    if os.path.isfile(review_path):
+        with open(review_path) as f:
+            return json.load(f)
+    return {}
+
+def apply_nmk_review(exp: types.Experiment, review: Dict[str, int]):
+    for nmk in exp.results.slac_nmk:
+        if nmk.nmk in review and nmk.random != review[nmk.nmk]:
+            nmk.random = review[nmk.nmk]
+            exp.results.disk_synced = False
+
+# Storage
+
+#Optional SQLite storage instead of the processed.json and overview.json files.
+#Results not found in it are still read from the files.
+result_store: ResultStore | None = None
+
+def use_result_store(path: str | None):
+    global result_store
+    if result_store is not None:
+        result_store.close()
+    result_store = ResultStore(path) if path is not None else None
+
+#Group writes to the result store into one transaction
+def store_batch():
+    if result_store is not None:
+        return result_store.batch()
+    return contextlib.nullcontext()
+
+#Processed experiments of a plug in the result store, read at once for the lookups of read_processed_json.
+#None without a result store.
+def stored_experiments(plug: types.Plug) -> Dict[str, Any] | None:
+    if result_store is not None:
+        return result_store.get_plug_experiments(plug.id)
+    return None
+
+#stored: From stored_experiments, otherwise the result store is queried for this experiment
+def read_processed_json(exp: types.Experiment, stored: Dict[str, Any] | None = None) -> Any | None:
+    if stored is not None:
+        j = stored.get(to_key(exp.path))
+        if j is not None:
+            return j
+    elif result_store is not None:
+        j = result_store.get_experiment(exp.path)
+        if j is not None:
+            return j
     processed_file_path = os.path.join(exp.path, "processed.json")
     if os.path.isfile(processed_file_path):
         with open(processed_file_path, "r") as f:
-            j = json.load(f)
-            exp.results.set_from_json(j)
-            exp.time = j["time"]
+            return json.load(f)
+    return None
+
+def read_overview_json(plug: types.Plug) -> Any | None:
+    if result_store is not None:
+        j = result_store.get_plug(plug.id)
+        if j is not None:
+            return j
+    stat_file_path = os.path.join(plug.get_path(), "overview.json")
+    if os.path.isfile(stat_file_path):
+        with open(stat_file_path, "r") as f:
+            return json.load(f)
+    return None
+
+# Experiment
+
+#allow_stale: Also accept a processed.json whose inputs changed since it was written
+#stored: See read_processed_json
+@profiling.span("load_experiment")
+def load_experiment(plug: types.Plug, exp: types.Experiment, allow_stale: bool = False, stored: Dict[str, Any] | None = None) -> bool:
+    j = read_processed_json(exp, stored)
+    if j is not None:
+        fp = fingerprint.experiment_fingerprint(exp.path, PROCESSOR_VERSION)
+        if not allow_stale and j.get("fingerprint") != fp:
+            return False
+        exp.results.set_from_json(j)
+        exp.time = j["time"]
+        exp.fingerprint = j.get("fingerprint")
+        #Reviews do not change the raw results, apply any new ones
+        apply_nmk_review(exp, read_nmk_review(plug))
         return True
     return False
 
+@profiling.span("process_experiment")
 def process_experiment(plug: types.Plug, exp: types.Experiment) -> bool:
-    root_trace = load_data.read_result(exp.path)
+    root_trace = load_data.read_result(exp.path, wanted=processed_traces())
     if root_trace is None:
         return False
     
-    exp.version = root_trace.find_data("INFO")[0][1].data["v"]
-    exp.time = root_trace.find_data("INFO")[0][1].time
-
-    for _, entry in root_trace.traces():
-        if entry.name == "SLAC":
-            process_slac(exp, entry)
-        if entry.name.startswith("SDP_"):
-            process_sdp(exp, entry)
-        if entry.name.startswith("CONN_"):
-            process_conn(exp, entry)
-        if entry.name.startswith("SUPPORTED_"):
-            process_supported(exp, entry)
+    #The version is needed by the handlers
+    info = root_trace.find_data("INFO")[0][1]
+    exp.version = info.data["v"]
+    exp.time = info.time
 
-    review_path = os.path.join(plug.get_path(), "nmk_review.json")
-    if os.path.isfile(review_path):
-        with open(review_path) as f:
-            val = json.load(f)
-            for nmk in exp.results.slac_nmk:
-                if nmk.nmk in val:
-                    nmk.random = val[nmk.nmk]
+    dispatch_trace(exp, root_trace, (), [])
+
+    apply_nmk_review(exp, read_nmk_review(plug))
+
+    #After reading, result.json may have been regenerated
+    exp.fingerprint = fingerprint.experiment_fingerprint(exp.path, PROCESSOR_VERSION)
     
     return True
 
-def load_or_process_experiment(plug: types.Plug, exp: types.Experiment, run_policy: int) -> bool:
+def load_or_process_experiment(plug: types.Plug, exp: types.Experiment, run_policy: int, stored: Dict[str, Any] | None = None) -> bool:
     #Must run fresh
     if run_policy >= 3:
         if process_experiment(plug, exp):
             return True
     #Try load
-    if load_experiment(exp):
+    if load_experiment(plug, exp, allow_stale=(run_policy == 0), stored=stored):
         return True
     #Allowed to run
-    if run_policy == 1:
+    if run_policy >= 1:
         return process_experiment(plug, exp)
     return False
 
+@profiling.span("save_experiment")
 def save_experiment(exp: types.Experiment):
-    processed_file_path = os.path.join(exp.path, "processed.json")
-    with open(processed_file_path, "w") as f:
-        json.dump({"time": exp.time} | exp.results.to_json(), f)
-        exp.results.disk_synced = True
-
-def review_plug_nmk(plug: types.Plug):
-    if plug.experiments is None:
-        raise ValueError("No experiments to process")
-
-    nmks = [nmk for exp in plug.experiments for nmk in exp.results.slac_nmk]
-
-    need_review = False
-    for nmk in nmks:
-        if nmk.random is None:
-            need_review = True
-    if not need_review:
-        return
-    
-    print("\n".join([data.nmk for data in nmks]))
-    val = int(input("0: Pattern, 1: Partial, 2: Random? "))
+    j = {"time": exp.time, "fingerprint": exp.fingerprint} | exp.results.to_json()
+    if result_store is not None:
+        result_store.put_experiment(path_tools.get_plug_id(exp.path), exp.path, j)
+    else:
+        processed_file_path = os.path.join(exp.path, "processed.json")
+        with open(processed_file_path, "w") as f:
+            json.dump(j, f)
+    exp.results.disk_synced = True
 
-    nmk_dict = {
-        nmk.nmk: val for exp in plug.experiments for nmk in exp.results.slac_nmk
-    }
+# NMK review
 
+#NMKs of the plug that have not been reviewed yet, once per observation, so keys reused between experiments show up
+def pending_nmks(plug: types.Plug) -> List[str]:
+    if plug.experiments is None:
+        return []
+    return [nmk.nmk for exp in plug.experiments for nmk in exp.results.slac_nmk if nmk.random is None]
+
+#Queue of plug ID -> NMKs waiting for a human to review them with python3 -m proc_code.review_nmk
+def read_nmk_review_queue() -> Dict[str, List[str]]:
+    if os.path.isfile(path_tools.NMK_REVIEW_QUEUE_FILE):
+        with open(path_tools.NMK_REVIEW_QUEUE_FILE, "r") as f:
+            return json.load(f)
+    return {}
+
+def write_nmk_review_queue(queue: Dict[str, List[str]]):
+    tmp_path = path_tools.NMK_REVIEW_QUEUE_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(queue, f, indent=2)
+    os.replace(tmp_path, path_tools.NMK_REVIEW_QUEUE_FILE)
+
+#Record the pending NMKs of all plugs that had their experiments processed
+def update_nmk_review_queue(plugs: Iterable[types.Plug]):
+    write_pending_nmks({plug.id: pending_nmks(plug) for plug in plugs if plug.experiments is not None})
+
+#Same as update_nmk_review_queue, with the pending NMKs of each processed plug collected before its experiments were released
+@profiling.span("nmk_review_queue")
+def write_pending_nmks(pending_by_plug: Dict[str, List[str]]):
+    queue = read_nmk_review_queue()
+    changed = False
+    for plug_id, pending in pending_by_plug.items():
+        if len(pending) > 0:
+            if queue.get(plug_id) != pending:
+                queue[plug_id] = pending
+                changed = True
+        elif plug_id in queue:
+            del queue[plug_id]
+            changed = True
+    if changed:
+        write_nmk_review_queue(queue)
+
+#Merge review decisions NMK -> 0: Pattern, 1: Partial, 2: Random into the nmk_review.json of the plug
+def save_nmk_review(plug: types.Plug, decisions: Dict[str, int]):
+    review = read_nmk_review(plug) | decisions
     with open(os.path.join(plug.get_path(), "nmk_review.json"), "w") as f:
-        json.dump(nmk_dict, f, indent=2)
-
-    for exp in plug.experiments:
-        for nmk in exp.results.slac_nmk:
-            nmk.random = val
-            exp.results.disk_synced = False
+        json.dump(review, f, indent=2)
 
 # Plug
 
+#All results of the plug in one list each, only built on request. The statistics are counted without it.
+@profiling.span("compact_results")
 def compact_results(self: types.Plug):
     if self.experiments is None:
         raise ValueError("Load experiments before compatcting")
@@ -251,47 +409,32 @@ def compact_results(self: types.Plug):
     self.compacted.tls_results.weak = [x for exp in self.experiments for x in exp.results.tls_results.weak]
     self.compacted.tls_results.old = [x for exp in self.experiments for x in exp.results.tls_results.old]
 
+#TLS 1.2 cipher verdicts, these depend on the TLS 1.3 results of all experiments
+def calculate_cipher_support(reduced: types.ReducedResult):
+    strong_tmp = dict(reduced.tls_strong_raw)
+    weak_tmp = dict(reduced.tls_strong_raw)
+    if reduced.tls_support_v13[True] > 0:
+        #Unsure observations from early software version that detecte TLS 1.3 as weak/strong ciphers
+        strong_tmp[1] = 0
+        weak_tmp[1] = 0
+        print("Cleared")
+    reduced.tls_support_strong = {False: strong_tmp[0], True: strong_tmp[1] + strong_tmp[2]}
+    reduced.tls_support_weak = {False: strong_tmp[0], True: strong_tmp[1] + strong_tmp[2]}
+
+#Counts the results of each experiment straight into the reduced counters, without building plug.compacted
+@profiling.span("calculate_stats")
 def calculate_stats(self: types.Plug, experiment_times: List[str]):
-    if self.compacted is None:
-        compact_results(self)
-    #Just to make type checker happy
-    if self.compacted is None:
+    if self.experiments is None:
         raise ValueError("No data for statistics")
 
     self.reduced = types.ReducedResult()
+    self.reduced.add_results([exp.results for exp in self.experiments])
 
     self.reduced.experiments = experiment_times
 
-    self.reduced.nmk_random |= count_elements([x.random for x in self.compacted.slac_nmk if x.random is not None])
-    self.reduced.nid_match |= count_elements([x.nid_match for x in self.compacted.slac_nmk])
-
-    self.reduced.tls_support |= count_elements([x.res_tls for x in self.compacted.sdp_results if x.req_tls])
-    self.reduced.tls_support_v13 |= count_elements([x for x in self.compacted.tls_results.v13])
-    self.reduced.tls_support_v12 |= count_elements([x for x in self.compacted.tls_results.v12])
-    strong_tmp = {0:0, 1:0, 2:0} | count_elements([x for x in self.compacted.tls_results.strong])
-    weak_tmp = {0:0, 1:0, 2:0} | count_elements([x for x in self.compacted.tls_results.strong])
-    if self.reduced.tls_support_v13[True] > 0:
-        #Unsure observations from early software version that detecte TLS 1.3 as weak/strong ciphers
-        strong_tmp[1] = 0
-        weak_tmp[1] = 0
-        print("Cleared")
-    self.reduced.tls_support_strong |= {False: strong_tmp[0], True: strong_tmp[1] + strong_tmp[2]}
-    self.reduced.tls_support_weak |= {False: strong_tmp[0], True: strong_tmp[1] + strong_tmp[2]}
-    self.reduced.tls_support_old |= count_elements([x for x in self.compacted.tls_results.old])
-
-    self.reduced.preferred |= count_elements([x for x in self.compacted.support_results.preferred])
-    self.reduced.din_support |= count_elements([x == "DIN" for x in self.compacted.support_results.din])
-    self.reduced.v2v10_support |= count_elements([x == "V2V10" for x in self.compacted.support_results.v2v10])
-    self.reduced.v2v13_support |= count_elements([x == "V2V13" for x in self.compacted.support_results.v2v13])
-    self.reduced.v20dc_support |= count_elements([x == "V20DC" for x in self.compacted.support_results.v20dc])
-
-    self.reduced.hle_mac |= count_elements([x.evse_mac for x in self.compacted.slac_ids])
-    self.reduced.phy_mac |= count_elements([x.mac for x in self.compacted.hpgp])
-    self.reduced.phy_chip |= count_elements([x.ident for x in self.compacted.hpgp])
-    self.reduced.phy_fw |= count_elements([x.version for x in self.compacted.hpgp])
-    self.reduced.phy_mfg |= count_elements([x.mfg for x in self.compacted.hpgp])
-    self.reduced.phy_usr |= count_elements([x.usr for x in self.compacted.hpgp])
+    calculate_cipher_support(self.reduced)
 
+@profiling.span("calculate_final")
 def calculate_final(self: types.Plug):
     if self.reduced is None:
         raise ValueError()
@@ -332,46 +475,141 @@ def calculate_final(self: types.Plug):
         self.final.tls_support_weak = 0
         self.final.tls_support_old = 0
 
-def load_plug(plug: types.Plug) -> bool:
+#allow_stale: Also accept an overview.json whose inputs changed since it was written
+@profiling.span("load_plug")
+def load_plug(plug: types.Plug, allow_stale: bool = False) -> bool:
     res = False
-    stat_file_path = os.path.join(plug.get_path(), "overview.json")
-    if os.path.isfile(stat_file_path):
-        with open(stat_file_path, "r") as f:
-            plug.final = types.FinalResult.from_json(json.load(f))
-            plug.final_sync_with_disk = True
+    j = read_overview_json(plug)
+    if j is not None:
+        final = types.FinalResult.from_json(j)
+
+        #Manually entered results, and plugs with only an overview.json, have nothing to be recomputed from
+        if final.computed and not allow_stale:
+            exp_folders = load_data.plug_experiment_folders(plug)
+            if len(exp_folders) > 0 and final.fingerprint != fingerprint.plug_fingerprint(plug.get_path(), exp_folders, PROCESSOR_VERSION):
+                return False
+
+        plug.final = final
+        plug.final_sync_with_disk = True
         res = True
     return res
 
+#Experiments closer than 4 hours after the previous one count as the same visit, returns the time of each visit
+def filter_experiment_times(times: Iterable[str]) -> List[str]:
+    exp_times: List[datetime.datetime] = [
+        datetime.datetime.strptime(t[:19], "%Y-%m-%d %H:%M:%S")
+    for t in times]
+    
+    exp_times = sorted(exp_times)
+    exp_times_filter_last: datetime.datetime | None = None
+    exp_times_filter = []
+    for t in exp_times:
+        if (exp_times_filter_last is None) or (t > (exp_times_filter_last + datetime.timedelta(hours=4))):
+            exp_times_filter.append(datetime.datetime.strftime(t, "%Y-%m-%d %H:%M:%S"))
+        exp_times_filter_last = t
+    return exp_times_filter
+
+def reduce_plug(plug: types.Plug):
+    if plug.experiments is None:
+        raise ValueError("No experiments to reduce")
+
+    for exp in plug.experiments:
+        if not exp.results.disk_synced:
+            save_experiment(exp)
+
+    calculate_stats(plug, filter_experiment_times([exp.time for exp in plug.experiments])) #type:ignore
+    calculate_final(plug)
+
+def read_reduced_json(plug: types.Plug) -> Any | None:
+    if result_store is not None:
+        j = result_store.get_reduced(plug.id)
+        if j is not None:
+            return j
+    reduced_file_path = os.path.join(plug.get_path(), "reduced.json")
+    if os.path.isfile(reduced_file_path):
+        with open(reduced_file_path, "r") as f:
+            return json.load(f)
+    return None
+
+@profiling.span("save_reduced")
+def save_reduced(plug: types.Plug):
+    if plug.reduced is None:
+        return
+    if result_store is not None:
+        result_store.put_reduced(plug.id, plug.reduced.to_json())
+    else:
+        with open(os.path.join(plug.get_path(), "reduced.json"), "w") as f:
+            json.dump(plug.reduced.to_json(), f)
+
+#Record which experiment folders the reduced counts cover, all folders of the plug in order, including unreadable ones
+def set_reduced_inputs(plug: types.Plug, exp_folders: List[str]):
+    if plug.reduced is None or plug.experiments is None:
+        return
+    plug_path = plug.get_path()
+    plug.reduced.folders = {os.path.relpath(f, plug_path): fingerprint.experiment_fingerprint(f, PROCESSOR_VERSION) for f in exp_folders}
+    plug.reduced.times = {os.path.relpath(exp.path, plug_path): exp.time for exp in plug.experiments} #type:ignore
+    plug.reduced.fingerprint = fingerprint.reduced_fingerprint(plug_path, PROCESSOR_VERSION)
+
+#Add only the experiments that are new since reduced.json was saved to its counts, then recompute the verdicts.
+#Falls back to a full reduce (returns False) if a counted experiment changed or is gone, a new one is listed before
+#counted ones (the order of the values in "Multiple" verdicts would change), the NMK review changed, or NMKs are waiting
+#for a review (the review queue is built from all experiments).
+@profiling.span("merge_plug")
+def merge_new_experiments(plug: types.Plug, exp_folders: List[str], run_policy: int, stored: Dict[str, Any] | None = None) -> bool:
+    j = read_reduced_json(plug)
+    if j is None:
+        return False
+    reduced = types.ReducedResult.from_json(j)
+    plug_path = plug.get_path()
+    if reduced.nmk_pending > 0 or reduced.fingerprint != fingerprint.reduced_fingerprint(plug_path, PROCESSOR_VERSION):
+        return False
+
+    rel_folders = [os.path.relpath(f, plug_path) for f in exp_folders]
+    counted = list(reduced.folders.keys())
+    if rel_folders[:len(counted)] != counted:
+        return False
+    for rel, fp in reduced.folders.items():
+        if fingerprint.experiment_fingerprint(os.path.join(plug_path, rel), PROCESSOR_VERSION) != fp:
+            return False
+
+    new = [types.Experiment(f, None, None, types.ExperimentResult()) for f in exp_folders[len(counted):]]
+    plug.experiments = [exp for exp in new if load_or_process_experiment(plug, exp, run_policy, stored)]
+    reduced.add_results([exp.results for exp in plug.experiments])
+    for exp in plug.experiments:
+        if not exp.results.disk_synced:
+            save_experiment(exp)
+        reduced.times[os.path.relpath(exp.path, plug_path)] = exp.time #type:ignore
+    for f in exp_folders[len(counted):]:
+        reduced.folders[os.path.relpath(f, plug_path)] = fingerprint.experiment_fingerprint(f, PROCESSOR_VERSION)
+
+    reduced.experiments = filter_experiment_times(reduced.times.values())
+    calculate_cipher_support(reduced)
+    plug.reduced = reduced
+    calculate_final(plug)
+    return True
+
+@profiling.span("process_plug")
 def process_plug(plug: types.Plug, run_policy: int) -> bool:
     load_data.read_plug_experiments(plug)
 
     if plug.experiments is not None and len(plug.experiments) > 0:
         print(f"Processing {plug.id}")
-        for exp in plug.experiments:
-            load_or_process_experiment(plug, exp, run_policy)
-            
-        review_plug_nmk(plug)
-
-        for exp in plug.experiments:
-            if not exp.results.disk_synced:
-                save_experiment(exp)
-
-        compact_results(plug)
-
-        exp_times: List[datetime.datetime] = [
-            datetime.datetime.strptime(exp.time[:19], "%Y-%m-%d %H:%M:%S") #type:ignore
-        for exp in plug.experiments]
-        
-        exp_times = sorted(exp_times)
-        exp_times_filter_last: datetime.datetime | None = None
-        exp_times_filter = []
-        for t in exp_times:
-            if (exp_times_filter_last is None) or (t > (exp_times_filter_last + datetime.timedelta(hours=4))):
-                exp_times_filter.append(datetime.datetime.strftime(t, "%Y-%m-%d %H:%M:%S"))
-            exp_times_filter_last = t
-
-        calculate_stats(plug, exp_times_filter)
-        calculate_final(plug)
+        exp_folders = [exp.path for exp in plug.experiments]
+        #Experiments are always processed again with run_policy 3, nothing is loaded
+        stored = stored_experiments(plug) if run_policy < 3 else None
+
+        #Plugs that are not rerun from scratch only count their new experiments, plug.experiments then holds only those
+        if run_policy >= 2 or not merge_new_experiments(plug, exp_folders, run_policy, stored):
+            #Experiments that could not be read, such as from a crashed data collector, are left out
+            plug.experiments = [exp for exp in plug.experiments if load_or_process_experiment(plug, exp, run_policy, stored)]
+
+            #NMKs that still need a review stay unknown until reviewed, see update_nmk_review_queue
+            reduce_plug(plug)
+            set_reduced_inputs(plug, exp_folders)
+        save_reduced(plug)
+
+        if plug.final is not None:
+            plug.final.fingerprint = fingerprint.plug_fingerprint(plug.get_path(), exp_folders, PROCESSOR_VERSION)
 
         return True
     else:
@@ -379,13 +617,14 @@ def process_plug(plug: types.Plug, run_policy: int) -> bool:
     return False
 
 #0: Load only, 1: Load then run, 2: Run plug (load experiments then run) then load, 3: Run plug (Run experiments then load experiments) then load
+@profiling.span("plug")
 def load_or_process_plug(plug: types.Plug, run_policy: int):
     #Must run fresh
     if run_policy >= 2:
         if process_plug(plug, run_policy):
             return True
     #Try load
-    if load_plug(plug):
+    if load_plug(plug, allow_stale=(run_policy == 0)):
         return True
     #Allowed to run
     if run_policy == 1:
@@ -394,84 +633,249 @@ def load_or_process_plug(plug: types.Plug, run_policy: int):
     
     plug.final = types.FinalResult()
     plug.final_sync_with_disk = False
+
+#Drop the experiments and intermediate results of a plug, keeping only plug.final. Used to bound memory once the
+#results are saved, processing already saved the experiments and reduced.json. See load_plug_details to get them back.
+def release_plug(plug: types.Plug):
+    plug.experiments = None
+    plug.compacted = None
+    plug.reduced = None
+
+#Experiments and reduced counts of a plug, reloaded from the saved results if they were released. Nothing is processed,
+#experiments without a processed.json are left out.
+@profiling.span("load_plug_details")
+def load_plug_details(plug: types.Plug) -> List[types.Experiment]:
+    if plug.experiments is None:
+        load_data.read_plug_experiments(plug)
+        stored = stored_experiments(plug)
+        plug.experiments = [exp for exp in plug.experiments or [] if load_experiment(plug, exp, allow_stale=True, stored=stored)]
+    if plug.reduced is None:
+        j = read_reduced_json(plug)
+        if j is not None:
+            plug.reduced = types.ReducedResult.from_json(j)
+    return plug.experiments
     
+# Parallel processing
+
+_worker_meta: metadata.Metadata | None = None
+
+def _init_plug_worker(meta: metadata.Metadata, store_path: str | None, experiment_index: Dict[str, List[str]], profiling_config: Tuple[bool, str | None]):
+    global _worker_meta
+    _worker_meta = meta
+    use_result_store(store_path)
+    load_data.use_experiment_index(experiment_index)
+    profiling.apply_config(profiling_config)
+    #Forked workers start with the totals of the parent, which the parent already has
+    profiling.stats = {}
+
+#Runs inside a worker process. Only the results are sent back, the Plug itself references the whole metadata tree.
+#With release, the worker saves the plug and sends back only plug.final and the pending NMKs.
+def _process_plug_worker(args: Tuple[str, int, bool]):
+    plug_id, run_policy, release = args
+    if _worker_meta is None:
+        raise ValueError("Worker not initialised")
+
+    plug = _worker_meta.plugs[plug_id]
+    with store_batch(), profiling.plug_scope(plug_id):
+        load_or_process_plug(plug, run_policy)
+        pending = pending_nmks(plug) if plug.experiments is not None else None
+        if release:
+            if not plug.final_sync_with_disk:
+                save_plug(plug)
+            release_plug(plug)
+    res = (plug_id, plug.experiments, plug.compacted, plug.reduced, plug.final, plug.final_sync_with_disk, pending, profiling.take_stats())
+
+    #Do not keep results alive in the worker
+    plug.experiments = None
+    plug.compacted = None
+    plug.reduced = None
+    plug.final = None
+    return res
+
+#Same as calling load_or_process_plug on every plug, spread over jobs worker processes.
+#The experiments of all plugs are discovered up front, afterwards the NMK review queue is updated for all processed plugs.
+#release: Bounded memory, each plug is saved as soon as it is done and only plug.final is kept, see release_plug
+def process_all_plugs(meta: metadata.Metadata, run_policy: int, jobs: int | None = None, release: bool = False):
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    experiment_index = load_data.build_experiment_index()
+    #Plug ID -> NMKs waiting for review, of the plugs whose experiments were loaded
+    pending: Dict[str, List[str]] = {}
+
+    if jobs <= 1:
+        for plug in meta.plugs.values():
+            with store_batch(), profiling.plug_scope(plug.id):
+                load_or_process_plug(plug, run_policy)
+                if plug.experiments is not None:
+                    pending[plug.id] = pending_nmks(plug)
+                if release:
+                    if not plug.final_sync_with_disk:
+                        save_plug(plug)
+                    release_plug(plug)
+        write_pending_nmks(pending)
+        return
+
+    #SQLite connections must not be used across a fork, the workers open their own and the parent reopens it after
+    store_path = result_store.path if result_store is not None else None
+    use_result_store(None)
+    with multiprocessing.Pool(jobs, initializer=_init_plug_worker, initargs=(meta, store_path, experiment_index, profiling.config())) as pool:
+        use_result_store(store_path)
+        tasks = [(plug_id, run_policy, release) for plug_id in meta.plugs.keys()]
+        for plug_id, experiments, compacted, reduced, final, final_sync_with_disk, plug_pending, stats in pool.imap_unordered(_process_plug_worker, tasks, chunksize=4):
+            profiling.merge_stats(stats)
+            plug = meta.plugs[plug_id]
+            plug.experiments = experiments
+            plug.compacted = compacted
+            plug.reduced = reduced
+            plug.final = final
+            plug.final_sync_with_disk = final_sync_with_disk
+            if plug_pending is not None:
+                pending[plug_id] = plug_pending
+
+    write_pending_nmks(pending)
+
+@profiling.span("save_plug")
 def save_plug(plug: types.Plug):
     if plug.final is None:  
         return
 
-    processed_file_path = os.path.join(plug.get_path(), "overview.json")
-    os.makedirs(os.path.dirname(processed_file_path), exist_ok=True)
-    with open(processed_file_path, "w") as f:
-        json.dump(plug.final.to_json(), f, indent = 2)
-
-def compute_stats(plugs: List[types.Plug]):
-
-    all_breakdowns: List[str] = ["2013", "2014", "2015", "2016", "2017", "2018", "2019", "2020", "2021", "2022", "2023", "2024", "????", "ALL"]
-
-    def gen_entry() -> dict[str, dict[int, int]]:
-        return {k: {0: 0, 1: 0, 2: 0} for k in all_breakdowns}
+    if result_store is not None:
+        result_store.put_plug(plug.id, plug.final.to_json())
+    else:
+        processed_file_path = os.path.join(plug.get_path(), "overview.json")
+        os.makedirs(os.path.dirname(processed_file_path), exist_ok=True)
+        tmp_path = processed_file_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(plug.final.to_json(), f, indent = 2)
+        os.replace(tmp_path, processed_file_path)
+    plug.final_sync_with_disk = True
+
+#Save the results of the plugs changed since they were last saved. Returns the number saved.
+def save_dirty_plugs(plugs: Iterable[types.Plug]) -> int:
+    dirty = [plug for plug in plugs if not plug.final_sync_with_disk and plug.final is not None]
+    with store_batch():
+        for plug in dirty:
+            save_plug(plug)
+    return len(dirty)
+
+#Rows of tls.csv, and the FinalResult field counted in each
+TLS_STATS = {
+    "TLS_SDP": "tls_support",
+
+    "TLS_V20": "tls_support_v13",
+    "TLS_V2": "tls_support_v12",
+    "TLS_Strong": "tls_support_strong",
+    "TLS_Weak": "tls_support_weak",
+    "TLS_Old": "tls_support_old",
+
+    "V20DC": "v20dc_support",
+    "V2V13": "v2v13_support",
+    "V2V10": "v2v10_support",
+    "DIN": "din_support",
+}
+
+#Breakdowns written by compute_breakdowns, the name of the output file and the columns to group by
+BREAKDOWNS: Dict[str, List[str]] = {
+    "country": ["country"],
+    "park_type": ["park_type"],
+    "network": ["network"],
+    "manufacturer": ["manufacturer"],
+    "country_year": ["country", "year"],
+}
+
+#Columns of compute_stats
+STATS_BREAKDOWNS: List[str] = ["2013", "2014", "2015", "2016", "2017", "2018", "2019", "2020", "2021", "2022", "2023", "2024", "????", "ALL"]
+
+#folder: Where to write tls.csv, output/ by default
+#table: FleetTable of the plugs if already built, shared between compute_stats, compute_breakdowns and compute_stats_intervals
+def compute_stats(plugs: List[types.Plug], folder: str | None = None, table: fleet_table.FleetTable | None = None):
+
+    all_breakdowns = list(STATS_BREAKDOWNS)
+
+    if table is None:
+        table = fleet_table.FleetTable.from_plugs(plugs)
+    #Years outside of the breakdowns only count towards ALL
+    stats = table.crosstab(TLS_STATS, ["year"], all_breakdowns[:-1])
+
+    if folder is None:
+        folder = os.path.join(path_tools.REPO_BASE_DIR, "output")
+    os.makedirs(folder, exist_ok=True)
+    stats.write_csv(os.path.join(folder, "tls.csv"))
 
-    all_stats: dict[str, dict[str, dict[int, int]]] = {
-        "TLS_SDP": gen_entry(),
+    #print(tls_stats)
+    return stats.to_dict(), all_breakdowns
 
-        "TLS_V20": gen_entry(),
-        "TLS_V2": gen_entry(),
-        "TLS_Strong": gen_entry(),
-        "TLS_Weak": gen_entry(),
-        "TLS_Old": gen_entry(),
+#Same stats as compute_stats, grouped by any columns of fleet_table, see BREAKDOWNS. Written to tls_<name>.csv
+def compute_breakdowns(plugs: List[types.Plug], breakdowns: Dict[str, List[str]] = BREAKDOWNS, folder: str | None = None, stats: Dict[str, str] = TLS_STATS, table: fleet_table.FleetTable | None = None) -> Dict[str, fleet_table.Crosstab]:
+    if table is None:
+        table = fleet_table.FleetTable.from_plugs(plugs)
+    res = table.crosstabs(stats, breakdowns)
 
-        "V20DC": gen_entry(),
-        "V2V13": gen_entry(),
-        "V2V10": gen_entry(),
-        "DIN": gen_entry(),
-    }
+    if folder is None:
+        folder = os.path.join(path_tools.REPO_BASE_DIR, "output")
+    os.makedirs(folder, exist_ok=True)
+    for name, crosstab in res.items():
+        crosstab.write_csv(os.path.join(folder, f"tls_{name}.csv"))
+    return res
 
-    def count_stat(type: str, year: int | None, val: int):
-        if val != -1:
-            all_stats[type][str(year) if year is not None else "????"][val] += 1
-            all_stats[type]["ALL"][val] += 1
+#Confidence intervals of the percentages in compute_stats, written to tls_ci.csv.
+#method is "wilson", or "bootstrap" to resample parks since plugs of the same park are not independent
+def compute_stats_intervals(plugs: List[types.Plug], folder: str | None = None, method: str = "bootstrap", resamples: int = 2000, level: float = 0.95, table: fleet_table.FleetTable | None = None) -> confidence.Intervals:
+    if table is None:
+        table = fleet_table.FleetTable.from_plugs(plugs)
+    if method == "wilson":
+        res = confidence.wilson_intervals(table.crosstab(TLS_STATS, ["year"], STATS_BREAKDOWNS[:-1]), level)
+    elif method == "bootstrap":
+        res = confidence.bootstrap_intervals(table, TLS_STATS, ["year"], STATS_BREAKDOWNS[:-1], resamples, level)
+    else:
+        raise ValueError(f"Unknown interval method {method}")
 
-    for plug in plugs:
-        if plug.final is None:
-            continue
+    if folder is None:
+        folder = os.path.join(path_tools.REPO_BASE_DIR, "output")
+    os.makedirs(folder, exist_ok=True)
+    res.write_csv(os.path.join(folder, "tls_ci.csv"))
+    return res
 
-        count_stat("TLS_SDP", plug.charger.mfg_year, plug.final.tls_support)
+def main(args: argparse.Namespace):
+    use_result_store(args.store)
 
-        count_stat("TLS_V20", plug.charger.mfg_year, plug.final.tls_support_v13)
-        count_stat("TLS_V2", plug.charger.mfg_year, plug.final.tls_support_v12)
-        count_stat("TLS_Strong", plug.charger.mfg_year, plug.final.tls_support_strong)
-        count_stat("TLS_Weak", plug.charger.mfg_year, plug.final.tls_support_weak)
-        count_stat("TLS_Old", plug.charger.mfg_year, plug.final.tls_support_old)
+    meta = metadata.read_charger_metadata_table()
 
-        count_stat("V20DC", plug.charger.mfg_year, plug.final.v20dc_support)
-        count_stat("V2V13", plug.charger.mfg_year, plug.final.v2v13_support)
-        count_stat("V2V10", plug.charger.mfg_year, plug.final.v2v10_support)
-        count_stat("DIN", plug.charger.mfg_year, plug.final.din_support)
+    process_all_plugs(meta, 1, args.jobs, release=args.low_memory)
 
-    def format_entry(entry: dict[int, int]):
-        return f"{entry[2] + entry[1]} / {entry[0]}"
+    save_dirty_plugs(meta.plugs.values())
 
-    full_table = [[""] + all_breakdowns] + [[k] + [format_entry(vv) for vv in v.values()] for k, v in all_stats.items()]
+    if result_store is not None and args.export_json:
+        result_store.export_json()
 
-    folder = os.path.join(path_tools.REPO_BASE_DIR, "output")
-    os.makedirs(folder, exist_ok=True)
-    with open(os.path.join(folder, "tls.csv"), "w") as f:
-        for line in full_table:
-            f.write(", ".join(line))
-            f.write("\n")
+    plugs = list(meta.plugs.values())
+    table = fleet_table.FleetTable.from_plugs(plugs)
+    compute_stats(plugs, table=table)
+    compute_breakdowns(plugs, table=table)
+    compute_stats_intervals(plugs, table=table)
 
-    #print(tls_stats)
-    return all_stats, all_breakdowns
+    use_result_store(None)
 
-    
 if __name__ == "__main__":
-    meta = metadata.read_charger_metadata_table()
-
-    for plug in meta.plugs.values():
-        load_or_process_plug(plug, 1)
-
-    for plug in meta.plugs.values():
-        if not plug.final_sync_with_disk:
-            save_plug(plug)
+    parser = argparse.ArgumentParser(description="Process all experiments and compute the plug verdicts")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes, defaults to the CPU count")
+    parser.add_argument("--store", default=None, help="Keep results in this SQLite database instead of processed.json/overview.json files")
+    parser.add_argument("--export-json", action="store_true", help="Write the results in the database back out as JSON files")
+    parser.add_argument("--low-memory", action="store_true", help="Save each plug as soon as it is processed and keep only its verdicts in memory")
+    parser.add_argument("--timing", action="store_true", help="Print the time spent in each stage and the slowest plugs")
+    parser.add_argument("--trace", default=None, help="Append the timing of every stage to this JSONL file, implies --timing")
+    parser.add_argument("--profile", default=None, help="Run under cProfile and write the stats to this file. Worker processes are not profiled, use with -j 1")
+    args = parser.parse_args()
+
+    if args.timing or args.trace is not None:
+        profiling.enable(args.trace)
+
+    if args.profile is not None:
+        profiling.run_cprofile(lambda: main(args), args.profile)
+    else:
+        main(args)
 
-    compute_stats(list(meta.plugs.values()))
+    if profiling.enabled:
+        print(profiling.summary())
+        profiling.disable()
@@ -0,0 +1,163 @@
+"""
+Opt-in timing of the processing stages.
+Functions and blocks are marked with span(), when enabled the wall and CPU time of each is added up per plug and stage,
+and optionally written to a JSONL trace. When disabled, a span costs one check.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+import functools
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, TextIO, Tuple
+
+enabled = False
+trace_path: str | None = None
+trace_file: TextIO | None = None
+
+#Plug the current spans are attributed to, None outside of a plug
+current_plug: str | None = None
+
+#(plug, stage) -> [calls, wall seconds, cpu seconds]
+Stats = Dict[Tuple[str | None, str], List[float]]
+stats: Stats = {}
+
+#trace: JSONL file to append every finished span to, None for only the totals
+def enable(trace: str | None = None):
+    global enabled, trace_path, trace_file
+    disable()
+    enabled = True
+    trace_path = trace
+    if trace is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(trace)), exist_ok=True)
+        #Worker processes append to the same file, one line per write
+        trace_file = open(trace, "a", buffering=1)
+
+def disable():
+    global enabled, trace_path, trace_file
+    if trace_file is not None:
+        trace_file.close()
+    enabled = False
+    trace_path = None
+    trace_file = None
+
+#Arguments to enable the same profiling in a worker process
+def config() -> Tuple[bool, str | None]:
+    return enabled, trace_path
+
+def apply_config(cfg: Tuple[bool, str | None]):
+    if cfg[0]:
+        enable(cfg[1])
+
+def record(stage: str, start: float, wall: float, cpu: float):
+    key = (current_plug, stage)
+    entry = stats.get(key)
+    if entry is None:
+        stats[key] = [1, wall, cpu]
+    else:
+        entry[0] += 1
+        entry[1] += wall
+        entry[2] += cpu
+
+    if trace_file is not None:
+        trace_file.write(json.dumps({"pid": os.getpid(), "plug": current_plug, "stage": stage, "start": start, "wall": wall, "cpu": cpu}) + "\n")
+
+#Time a stage, as a context manager or a decorator. Nested spans are counted in full in both.
+class span():
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.time()
+            self.wall = time.perf_counter()
+            self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        if enabled:
+            record(self.stage, self.start, time.perf_counter() - self.wall, time.process_time() - self.cpu)
+        return False
+
+    def __call__(self, fn: Callable) -> Callable:
+        stage = self.stage
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.time()
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(stage, start, time.perf_counter() - wall, time.process_time() - cpu)
+        return wrapper
+
+#Attribute the spans inside to a plug
+@contextmanager
+def plug_scope(plug_id: str):
+    global current_plug
+    prev = current_plug
+    current_plug = plug_id
+    try:
+        yield
+    finally:
+        current_plug = prev
+
+#Remove and return the collected totals, for worker processes to send them back
+def take_stats() -> Stats:
+    global stats
+    res = stats
+    stats = {}
+    return res
+
+def merge_stats(other: Stats):
+    for key, (calls, wall, cpu) in other.items():
+        entry = stats.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += calls
+        entry[1] += wall
+        entry[2] += cpu
+
+def stage_totals(s: Stats | None = None) -> Dict[str, List[float]]:
+    res: Dict[str, List[float]] = {}
+    for (_, stage), (calls, wall, cpu) in (s if s is not None else stats).items():
+        entry = res.setdefault(stage, [0, 0.0, 0.0])
+        entry[0] += calls
+        entry[1] += wall
+        entry[2] += cpu
+    return res
+
+#Wall and CPU time of each plug, in its outermost stage
+def plug_totals(stage: str = "process_plug", s: Stats | None = None) -> Dict[str, List[float]]:
+    return {plug: v for (plug, st), v in (s if s is not None else stats).items() if plug is not None and st == stage}
+
+def summary(top_plugs: int = 10) -> str:
+    lines = [f"{'Stage':<28}{'Calls':>9}{'Wall [s]':>12}{'CPU [s]':>12}{'Wall/call [ms]':>16}"]
+    for stage, (calls, wall, cpu) in sorted(stage_totals().items(), key=lambda x: -x[1][1]):
+        lines.append(f"{stage:<28}{int(calls):>9}{wall:>12.3f}{cpu:>12.3f}{1e3 * wall / max(calls, 1):>16.3f}")
+
+    plugs = sorted(plug_totals().items(), key=lambda x: -x[1][1])[:top_plugs]
+    if len(plugs) > 0:
+        lines.append("")
+        lines.append(f"{'Slowest plugs':<28}{'':>9}{'Wall [s]':>12}{'CPU [s]':>12}")
+        for plug, (_, wall, cpu) in plugs:
+            lines.append(f"{plug:<28}{'':>9}{wall:>12.3f}{cpu:>12.3f}")
+    lines.append("Nested stages are included in the time of their parent")
+    return "\n".join(lines)
+
+#Run fn under cProfile, writing the stats to path and printing the top functions by cumulative time
+def run_cprofile(fn: Callable[[], Any], path: str, top: int = 30) -> Any:
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn)
+    finally:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        profiler.dump_stats(path)
+        pstats.Stats(path).sort_stats("cumulative").print_stats(top)
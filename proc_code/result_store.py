@@ -0,0 +1,134 @@
+"""
+SQLite storage for processed experiments and plug overviews.
+Keeps the same content as the processed.json, reduced.json and overview.json files, but in a single database file.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+from typing import Any, Dict
+
+from . import path_tools
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS experiments (
+    path TEXT PRIMARY KEY,
+    plug_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS experiments_plug_id ON experiments(plug_id);
+
+CREATE TABLE IF NOT EXISTS plugs (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS reduced (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+#Experiment folders are stored relative to the charger folder, so the database can be moved with the data
+def to_key(exp_path: str) -> str:
+    return os.path.relpath(exp_path, path_tools.CHARGER_DIR).replace(os.sep, "/")
+
+def from_key(key: str) -> str:
+    return os.path.join(path_tools.CHARGER_DIR, *key.split("/"))
+
+class ResultStore():
+    path: str
+    conn: sqlite3.Connection
+    batch_depth: int
+
+    def __init__(self, path: str):
+        self.path = path
+        #Worker processes write to the same database, wait for each other instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.batch_depth = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    #Group writes into one transaction. Outside of a batch every write is committed immediately.
+    @contextmanager
+    def batch(self):
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self.conn.commit()
+
+    def commit_if_needed(self):
+        if self.batch_depth == 0:
+            self.conn.commit()
+
+    # Experiments
+
+    def get_experiment(self, exp_path: str) -> Any | None:
+        row = self.conn.execute("SELECT data FROM experiments WHERE path = ?", (to_key(exp_path),)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    #All experiments of a plug in one query, by to_key of their folder
+    def get_plug_experiments(self, plug_id: str) -> Dict[str, Any]:
+        rows = self.conn.execute("SELECT path, data FROM experiments WHERE plug_id = ?", (plug_id,)).fetchall()
+        return {path: json.loads(data) for path, data in rows}
+
+    def put_experiment(self, plug_id: str, exp_path: str, j: Any):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO experiments (path, plug_id, data) VALUES (?, ?, ?)",
+            (to_key(exp_path), plug_id, json.dumps(j))
+        )
+        self.commit_if_needed()
+
+    # Plugs
+
+    def get_plug(self, plug_id: str) -> Any | None:
+        row = self.conn.execute("SELECT data FROM plugs WHERE id = ?", (plug_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_plug(self, plug_id: str, j: Any):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO plugs (id, data) VALUES (?, ?)",
+            (plug_id, json.dumps(j))
+        )
+        self.commit_if_needed()
+
+    def get_reduced(self, plug_id: str) -> Any | None:
+        row = self.conn.execute("SELECT data FROM reduced WHERE id = ?", (plug_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_reduced(self, plug_id: str, j: Any):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO reduced (id, data) VALUES (?, ?)",
+            (plug_id, json.dumps(j))
+        )
+        self.commit_if_needed()
+
+    # Export
+
+    #Write the contents back out as processed.json, reduced.json and overview.json files
+    def export_json(self):
+        for path, data in self.conn.execute("SELECT path, data FROM experiments"):
+            with open(os.path.join(from_key(path), "processed.json"), "w") as f:
+                f.write(data)
+
+        for plug_id, data in self.conn.execute("SELECT id, data FROM plugs"):
+            overview_path = os.path.join(path_tools.get_plug_path(plug_id), "overview.json")
+            os.makedirs(os.path.dirname(overview_path), exist_ok=True)
+            with open(overview_path, "w") as f:
+                json.dump(json.loads(data), f, indent = 2)
+
+        for plug_id, data in self.conn.execute("SELECT id, data FROM reduced"):
+            reduced_path = os.path.join(path_tools.get_plug_path(plug_id), "reduced.json")
+            os.makedirs(os.path.dirname(reduced_path), exist_ok=True)
+            with open(reduced_path, "w") as f:
+                f.write(data)
@@ -0,0 +1,97 @@
+"""
+Bulk review of the NMKs queued during processing.
+For each plug, a human decides whether its NMKs appear to have a visible pattern.
+The decisions are saved to nmk_review.json, and the verdicts of the plug are refreshed.
+"""
+
+from __future__ import annotations
+
+import argparse
+from typing import Dict, List, Tuple
+
+from . import metadata
+from . import nmk_classifier
+from . import process_data
+from . import types
+
+#Classify all queued NMKs together with the already reviewed ones, which are needed to detect keys reused between plugs
+def classify_queue(meta: metadata.Metadata, queue: Dict[str, List[str]]) -> Dict[Tuple[str, str], Tuple[int, float]]:
+    if len(queue) == 0:
+        return {}
+
+    nmks: List[str] = []
+    plug_ids: List[str] = []
+    for plug_id, plug in meta.plugs.items():
+        for nmk in (queue[plug_id] if plug_id in queue else process_data.read_nmk_review(plug).keys()):
+            nmks.append(nmk)
+            plug_ids.append(plug_id)
+
+    if len(nmks) == 0:
+        return {}
+    scores = nmk_classifier.classify_nmks(nmks, plug_ids)
+    return {(plug_id, nmk): (int(v), float(c)) for plug_id, nmk, v, c in zip(plug_ids, nmks, scores.verdict, scores.confidence)}
+
+#Returns the decision, None to skip, or raises KeyboardInterrupt to stop
+def prompt_review(plug_id: str, nmks: List[str], suggestions: Dict[Tuple[str, str], Tuple[int, float]]) -> int | None:
+    print(f"\n{plug_id}")
+    for nmk in nmks:
+        if (plug_id, nmk) in suggestions:
+            verdict, confidence = suggestions[(plug_id, nmk)]
+            print(f"{nmk}  suggested {verdict} ({confidence:.2f})")
+        else:
+            print(nmk)
+    while True:
+        val = input("0: Pattern, 1: Partial, 2: Random, s: Skip, q: Quit? ").strip()
+        if val in ["0", "1", "2"]:
+            return int(val)
+        if val == "s":
+            return None
+        if val == "q":
+            raise KeyboardInterrupt()
+
+#Save the decisions and recompute the plug verdicts, only the affected plug is reprocessed
+def apply_review(plug: types.Plug, decisions: Dict[str, int]):
+    process_data.save_nmk_review(plug, decisions)
+
+    with process_data.store_batch():
+        process_data.load_or_process_plug(plug, 1)
+        process_data.save_plug(plug)
+    process_data.update_nmk_review_queue([plug])
+
+def main():
+    parser = argparse.ArgumentParser(description="Review the NMKs queued during processing")
+    parser.add_argument("--store", default=None, help="SQLite database the results are kept in, as used with process_data")
+    parser.add_argument("--auto", type=float, nargs="?", const=0.8, default=None, metavar="CONFIDENCE",
+        help="Accept the classifier verdicts for plugs where all NMKs reach this confidence (default 0.8), only prompt for the rest")
+    args = parser.parse_args()
+
+    process_data.use_result_store(args.store)
+
+    meta = metadata.read_charger_metadata_table()
+    queue = process_data.read_nmk_review_queue()
+    print(f"{len(queue)} plugs waiting for review")
+
+    suggestions = classify_queue(meta, queue)
+
+    try:
+        for plug_id, nmks in list(queue.items()):
+            if plug_id not in meta.plugs:
+                print(f"Unknown plug {plug_id}, skipping")
+                continue
+
+            if args.auto is not None and all(suggestions[(plug_id, nmk)][1] >= args.auto for nmk in nmks):
+                print(f"{plug_id}: Accepted classifier verdicts")
+                apply_review(meta.plugs[plug_id], {nmk: suggestions[(plug_id, nmk)][0] for nmk in nmks})
+                continue
+
+            val = prompt_review(plug_id, nmks, suggestions)
+            if val is None:
+                continue
+            apply_review(meta.plugs[plug_id], {nmk: val for nmk in nmks})
+    except KeyboardInterrupt:
+        print("\nStopped, remaining plugs stay in the queue")
+
+    process_data.use_result_store(None)
+
+if __name__ == "__main__":
+    main()
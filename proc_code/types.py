@@ -1,14 +1,17 @@
 from __future__ import annotations
 import dataclasses
+import functools
 import os
-from typing import List, TypeVar, Dict
+import itertools
+import operator
+from typing import Any, Iterable, List, TypeVar, Dict
 
 from dataclasses import dataclass
 from typing import Dict, List, NamedTuple
 
 from . import path_tools
 
-from .utils import parse_float, parse_int, count_elements, verdict_bool, verdict_int, vertict_val
+from .utils import parse_float, parse_int, add_counts, verdict_bool, verdict_int, vertict_val
 
 @dataclass
 class Park:
@@ -24,6 +27,9 @@ class Park:
 
     chargers: List[Charger]
 
+    #Changed since parks.csv was last written
+    metadata_dirty: bool = False
+
     @staticmethod
     def create(x):
         return Park(
@@ -53,6 +59,9 @@ class Charger:
 
     plugs: List[Plug]
 
+    #Changed since chargers.csv was last written
+    metadata_dirty: bool = False
+
     @staticmethod
     def create(x, parks: Dict[str, Park]):
         park = parks[x["ID"].rsplit(".", 1)[0]]
@@ -84,6 +93,9 @@ class Plug:
     final: FinalResult | None
     final_sync_with_disk: bool
 
+    #Position or notes changed since plugs.csv was last written
+    metadata_dirty: bool = False
+
     @staticmethod
     def create(x, chargers: Dict[str, Charger]):
         charger = chargers[x["ID"].rsplit(".", 1)[0]]
@@ -117,6 +129,8 @@ class Experiment:
 
     results: ExperimentResult
 
+    fingerprint: str | None = None
+
     #def to_json(self):
     #    return {
     #        "path": self.path,
@@ -342,12 +356,21 @@ class ExperimentResult:
         res.set_from_json(j)
         return res
 
+#JSON object keys are strings, restore the bool and int keys of the counters
+def bool_keys(j: Dict[str, int]) -> Dict[bool, int]:
+    return {k == "true" if isinstance(k, str) else k: v for k, v in j.items()}
+
+def int_keys(j: Dict[str, int]) -> Dict[int, int]:
+    return {int(k): v for k, v in j.items()}
+
 @dataclass
 class ReducedResult:
     experiments: List[str]
 
     nmk_random: Dict[int, int]
     nid_match: Dict[bool, int]
+    #NMKs not reviewed yet, not counted in nmk_random
+    nmk_pending: int
 
     tls_support: Dict[bool, int]
     tls_support_v13: Dict[bool, int]
@@ -355,6 +378,9 @@ class ReducedResult:
     tls_support_strong: Dict[bool, int]
     tls_support_weak: Dict[bool, int]
     tls_support_old: Dict[bool, int]
+    #Counts of the 0/1/2 cipher results, tls_support_strong and tls_support_weak are derived from these with all experiments known
+    tls_strong_raw: Dict[int, int]
+    tls_weak_raw: Dict[int, int]
 
     preferred: Dict[str, int]
     din_support: Dict[bool, int]
@@ -369,11 +395,19 @@ class ReducedResult:
     phy_mfg: Dict[str, int]
     phy_usr: Dict[str, int]
 
+    #Experiment folders counted, relative to the plug folder, in order -> fingerprint. Includes folders that could not be read.
+    folders: Dict[str, str]
+    #Experiment folder -> time of the experiment, for those that were read
+    times: Dict[str, str]
+    #Inputs other than the experiments, see fingerprint.reduced_fingerprint
+    fingerprint: str | None
+
     def __init__(self):
         self.experiments = []
 
         self.nmk_random = {0: 0, 1: 0, 2: 0}
         self.nid_match = {False: 0, True: 0}
+        self.nmk_pending = 0
 
         self.tls_support = {False: 0, True: 0}
         self.tls_support_v13 = {False: 0, True: 0}
@@ -381,6 +415,8 @@ class ReducedResult:
         self.tls_support_strong = {False: 0, True: 0}
         self.tls_support_weak = {False: 0, True: 0}
         self.tls_support_old = {False: 0, True: 0}
+        self.tls_strong_raw = {0: 0, 1: 0, 2: 0}
+        self.tls_weak_raw = {0: 0, 1: 0, 2: 0}
 
         self.preferred = {}
         self.din_support = {False: 0, True: 0}
@@ -395,12 +431,51 @@ class ReducedResult:
         self.phy_mfg = {}
         self.phy_usr = {}
 
+        self.folders = {}
+        self.times = {}
+        self.fingerprint = None
+
+    #Count the observations of experiments straight into the counters, without collecting them in lists first.
+    #The same as counting the compacted results of the experiments. Can be called again to add more experiments.
+    #The cipher verdicts are not updated, see process_data.calculate_cipher_support.
+    def add_results(self, results: List[ExperimentResult]):
+        def each(field: str) -> Iterable[Any]:
+            return itertools.chain.from_iterable(map(operator.attrgetter(field), results))
+
+        def values(field: str, attr: str) -> Iterable[Any]:
+            return map(operator.attrgetter(attr), each(field))
+
+        add_counts(self.nmk_random, (x.random for x in each("slac_nmk") if x.random is not None))
+        add_counts(self.nid_match, values("slac_nmk", "nid_match"))
+        self.nmk_pending += sum(1 for x in each("slac_nmk") if x.random is None)
+
+        add_counts(self.tls_support, (x.res_tls for x in each("sdp_results") if x.req_tls))
+        add_counts(self.tls_support_v13, each("tls_results.v13"))
+        add_counts(self.tls_support_v12, each("tls_results.v12"))
+        add_counts(self.tls_strong_raw, each("tls_results.strong"))
+        add_counts(self.tls_weak_raw, each("tls_results.weak"))
+        add_counts(self.tls_support_old, each("tls_results.old"))
+
+        add_counts(self.preferred, each("support_results.preferred"))
+        add_counts(self.din_support, map(functools.partial(operator.eq, "DIN"), each("support_results.din")))
+        add_counts(self.v2v10_support, map(functools.partial(operator.eq, "V2V10"), each("support_results.v2v10")))
+        add_counts(self.v2v13_support, map(functools.partial(operator.eq, "V2V13"), each("support_results.v2v13")))
+        add_counts(self.v20dc_support, map(functools.partial(operator.eq, "V20DC"), each("support_results.v20dc")))
+
+        add_counts(self.hle_mac, values("slac_ids", "evse_mac"))
+        add_counts(self.phy_mac, values("hpgp", "mac"))
+        add_counts(self.phy_chip, values("hpgp", "ident"))
+        add_counts(self.phy_fw, values("hpgp", "version"))
+        add_counts(self.phy_mfg, values("hpgp", "mfg"))
+        add_counts(self.phy_usr, values("hpgp", "usr"))
+
     def to_json(self):
         return {
             "experiments": self.experiments,
 
             "nmk_random": self.nmk_random,
             "nid_match": self.nid_match,
+            "nmk_pending": self.nmk_pending,
 
             "tls_support": self.tls_support,
             "tls_support_v13": self.tls_support_v13,
@@ -408,7 +483,8 @@ class ReducedResult:
             "tls_support_strong": self.tls_support_strong,
             "tls_support_weak": self.tls_support_weak,
             "tls_support_old": self.tls_support_old,
-
+            "tls_strong_raw": self.tls_strong_raw,
+            "tls_weak_raw": self.tls_weak_raw,
 
             "preferred": self.preferred,
             "din_support": self.din_support,
@@ -422,6 +498,10 @@ class ReducedResult:
             "phy_fw": self.phy_fw,
             "phy_mfg": self.phy_mfg,
             "phy_usr": self.phy_usr,
+
+            "folders": self.folders,
+            "times": self.times,
+            "fingerprint": self.fingerprint,
         }
 
     @staticmethod
@@ -429,21 +509,24 @@ class ReducedResult:
         res = ReducedResult()
         res.experiments = j["experiments"]
 
-        res.nmk_random = j["nmk_random"]
-        res.nid_match = j["nid_match"]
+        res.nmk_random = int_keys(j["nmk_random"])
+        res.nid_match = bool_keys(j["nid_match"])
+        res.nmk_pending = j.get("nmk_pending", 0)
         
-        res.tls_support = j["tls_support"]
-        res.tls_support_v13 = j["tls_support_v13"]
-        res.tls_support_v12 = j["tls_support_v12"]
-        res.tls_support_strong = j["tls_support_strong"]
-        res.tls_support_weak = j["tls_support_weak"]
-        res.tls_support_old = j["tls_support_old"]
+        res.tls_support = bool_keys(j["tls_support"])
+        res.tls_support_v13 = bool_keys(j["tls_support_v13"])
+        res.tls_support_v12 = bool_keys(j["tls_support_v12"])
+        res.tls_support_strong = bool_keys(j["tls_support_strong"])
+        res.tls_support_weak = bool_keys(j["tls_support_weak"])
+        res.tls_support_old = bool_keys(j["tls_support_old"])
+        res.tls_strong_raw = int_keys(j.get("tls_strong_raw", res.tls_strong_raw))
+        res.tls_weak_raw = int_keys(j.get("tls_weak_raw", res.tls_weak_raw))
 
         res.preferred = j["preferred"]
-        res.din_support = j["din_support"]
-        res.v2v10_support = j["v2v10_support"]
-        res.v2v13_support = j["v2v13_support"]
-        res.v20dc_support = j["v20dc_support"]
+        res.din_support = bool_keys(j["din_support"])
+        res.v2v10_support = bool_keys(j["v2v10_support"])
+        res.v2v13_support = bool_keys(j["v2v13_support"])
+        res.v20dc_support = bool_keys(j["v20dc_support"])
 
         res.hle_mac = j["hle_mac"]
         res.phy_mac = j["phy_mac"]
@@ -452,6 +535,10 @@ class ReducedResult:
         res.phy_mfg = j["phy_mfg"]
         res.phy_usr = j["phy_usr"]
 
+        res.folders = j.get("folders", {})
+        res.times = j.get("times", {})
+        res.fingerprint = j.get("fingerprint")
+
         return res
 
 @dataclass
@@ -482,6 +569,9 @@ class FinalResult:
     phy_mfg: str = ""
     phy_usr: str = ""
 
+    #Inputs the result was computed from, see fingerprint.plug_fingerprint
+    fingerprint: str = ""
+
     def to_json(self):
         return {
             "experiments": self.experiments,
@@ -509,6 +599,8 @@ class FinalResult:
             "phy_fw": self.phy_fw,
             "phy_mfg": self.phy_mfg,
             "phy_usr": self.phy_usr,
+
+            "fingerprint": self.fingerprint,
         }
 
     @staticmethod
@@ -538,5 +630,7 @@ class FinalResult:
             phy_chip = j["phy_chip"],
             phy_fw = j["phy_fw"],
             phy_mfg = j["phy_mfg"],
-            phy_usr = j["phy_usr"]
+            phy_usr = j["phy_usr"],
+
+            fingerprint = j.get("fingerprint", ""),
         )
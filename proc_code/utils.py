@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import Any, List, TypeVar, Dict
+import collections
+from typing import Any, Iterable, List, TypeVar, Dict
 
 def parse_float(s: str) -> float:
     try:
@@ -24,6 +25,14 @@ def count_elements(input_list: List[T]) -> Dict[T, int]:
                 element_count[element] = 1
     return element_count
 
+#Add the elements to counts, in the same way as count_elements. New values are added in the order they are first seen.
+def add_counts(counts: Dict[T, int], elements: Iterable[T]):
+    for element, n in collections.Counter(elements).items():
+        if element in counts:
+            counts[element] += n
+        elif element != "":
+            counts[element] = n
+
 # Verdicets are stored as:
 # 2 - Definitely yes
 # 1 - Mixed results
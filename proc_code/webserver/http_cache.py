@@ -0,0 +1,156 @@
+"""
+Conditional and compressed responses for the webserver.
+Bodies carry a strong ETag, from a hash of their content unless given, and a matching If-None-Match is answered with
+304 Not Modified. HTML, CSS, JS and JSON are sent gzip or brotli compressed as the client accepts, the compressed
+variants are kept with the body, so a cached page or file is compressed only once per encoding.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+import gzip
+import hashlib
+import mimetypes
+import os
+from typing import Dict, Tuple
+
+from quart import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    "text/html", "text/css", "text/plain", "text/csv", "text/javascript",
+    "application/javascript", "application/json", "image/svg+xml",
+}
+
+#Smaller bodies are sent as they are, compression would not save a packet
+MIN_COMPRESS_SIZE = 512
+
+#Static files up to this size are kept in memory with their compressed variants, larger ones are streamed from disk
+MAX_CACHED_FILE = 4 * 1024 * 1024
+#Total size of the files kept in memory
+FILE_CACHE_BYTES = 64 * 1024 * 1024
+
+#Content-Encoding -> suffix of the ETag of the variant, in order of preference
+ENCODINGS: Dict[str, str] = ({"br": "br"} if brotli is not None else {}) | {"gzip": "gz"}
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data)
+    #No timestamp, so the same body always compresses to the same bytes
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+def content_etag(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+#Encoding from Accept-Encoding with the highest q value, ties go to the order of ENCODINGS. None for identity.
+def choose_encoding(accept_encoding: str | None) -> str | None:
+    if not accept_encoding:
+        return None
+    q: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        value = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                value = float(params[2:])
+            except ValueError:
+                value = 0.0
+        q[name.strip().lower()] = value
+
+    best: str | None = None
+    best_q = 0.0
+    for enc in ENCODINGS:
+        enc_q = q.get(enc, q.get("*", 0.0))
+        if enc_q > best_q:
+            best, best_q = enc, enc_q
+    return best
+
+#If-None-Match lists the ETag of the variant the client has, any variant of the same content counts as a match
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        tag = tag.removeprefix("W/").strip("\"")
+        base, _, suffix = tag.rpartition("-")
+        if tag == etag or (suffix in ENCODINGS.values() and base == etag):
+            return True
+    return False
+
+class Body():
+    data: bytes
+    mimetype: str
+    etag: str
+    #Content-Encoding -> compressed data
+    variants: Dict[str, bytes]
+
+    #etag is derived from the data if not given, such as from a version number of the object the body shows
+    def __init__(self, data: bytes | str, mimetype: str, etag: str | None = None):
+        self.data = data.encode() if isinstance(data, str) else data
+        self.mimetype = mimetype
+        self.etag = etag if etag is not None else content_etag(self.data)
+        self.variants = {}
+
+    def compressible(self) -> bool:
+        return self.mimetype in COMPRESSIBLE_TYPES and len(self.data) >= MIN_COMPRESS_SIZE
+
+    def encoded(self, encoding: str) -> bytes:
+        res = self.variants.get(encoding)
+        if res is None:
+            res = compress(self.data, encoding)
+            self.variants[encoding] = res
+        return res
+
+    def size(self) -> int:
+        return len(self.data) + sum(len(v) for v in self.variants.values())
+
+#Response for the current request: 304 if the client has the body, otherwise the body in the best accepted encoding.
+#Clients always revalidate, as pages change with every edit.
+def respond(body: Body) -> Response:
+    encoding = choose_encoding(request.headers.get("Accept-Encoding")) if body.compressible() else None
+    etag = body.etag if encoding is None else f"{body.etag}-{ENCODINGS[encoding]}"
+    headers = {"ETag": f"\"{etag}\"", "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+    if etag_matches(request.headers.get("If-None-Match"), body.etag):
+        return Response(b"", status=304, headers=headers)
+
+    if encoding is None:
+        return Response(body.data, status=200, headers=headers, mimetype=body.mimetype)
+    headers["Content-Encoding"] = encoding
+    return Response(body.encoded(encoding), status=200, headers=headers, mimetype=body.mimetype)
+
+def guess_mimetype(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+#Small compressible files on disk, by path: (mtime, size, body), least recently used first
+file_cache: OrderedDict[str, Tuple[int, int, Body]] = OrderedDict()
+
+def cacheable_file(path: str) -> bool:
+    return guess_mimetype(path) in COMPRESSIBLE_TYPES and os.path.getsize(path) <= MAX_CACHED_FILE
+
+#Body of a file, read again when its modification time or size changes
+def file_body(path: str) -> Body:
+    st = os.stat(path)
+    entry = file_cache.get(path)
+    if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+        file_cache.move_to_end(path)
+        return entry[2]
+
+    with open(path, "rb") as f:
+        body = Body(f.read(), guess_mimetype(path))
+    file_cache[path] = (st.st_mtime_ns, st.st_size, body)
+    file_cache.move_to_end(path)
+
+    #Variants grow the entries after they are added, the total is checked on every miss
+    total = sum(e[2].size() for e in file_cache.values())
+    while total > FILE_CACHE_BYTES and len(file_cache) > 1:
+        _, (_, _, old) = file_cache.popitem(last=False)
+        total -= old.size()
+    return body
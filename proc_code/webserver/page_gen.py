@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import base64
+from contextlib import contextmanager
 from dataclasses import dataclass
 import html
 import json
@@ -59,6 +60,8 @@ class SaveCall():
     def add(self, name: str):
         return lambda idx: self.args.__setitem__(name, idx)
 
+#Elements created outside of a uid_scope, such as the responses of the edit API, get a prefix that differs between runs,
+#so they never clash with the elements of a page already open in the browser
 uid_counter = 0
 uid_global = os.urandom(8).hex()
 def get_uid():
@@ -67,6 +70,19 @@ def get_uid():
     uid_counter += 1
     return f"elem_{uid_global}_{uid_counter}"
 
+#Number the elements created inside from 1 with a fixed prefix, so the same content always renders to the same HTML
+@contextmanager
+def uid_scope(prefix: str):
+    global uid_counter
+    global uid_global
+    prev = (uid_counter, uid_global)
+    uid_counter = 0
+    uid_global = prefix
+    try:
+        yield
+    finally:
+        uid_counter, uid_global = prev
+
 #
 # Create elements
 #
@@ -113,10 +129,15 @@ def create_kv_pair(k: str, vh: str):
     return f"<tr><td>{html.escape(k)}</td><td>{vh}</td></tr>"
 
 def create_image(src: str):
-    return f"<image height=200 src=\"{html.escape(src, quote=True)}\">"
+    return f"<image height={PHOTO_HEIGHT} src=\"{html.escape(src, quote=True)}\">"
+
+#Height of the photos shown in pages
+PHOTO_HEIGHT = 200
 
+#Thumbnail of the photo, opening the full photo on click
 def create_photo(fn: str):
-    return create_image('../photos/'  + path_tools.get_photo_dir(fn))
+    path = path_tools.get_photo_dir(fn)
+    return f"<a href=\"{html.escape('../photos/' + path, quote=True)}\">{create_image(f'../thumbs/{PHOTO_HEIGHT}/' + path)}</a>"
 
 def create_photo_list(fns: Iterable[str]):
     content = ''.join([create_photo(fn) for fn in fns])
@@ -149,31 +170,50 @@ def create_add_new_button(type: str, prefix: str):
 # Main page
 #
 
-def create_plug_table_header():
-    return f"<tr>\
-    <th>ID</th>\
-    <th>Town</th>\
-    <th>Manufacturer</th>\
-    <th>Operator</th>\
-    <th>Model</th>\
-    <th>TLS</th>\
-    <th>DIN</th>\
-    <th>15118-2</th>\
-    <th>Preferred</th>\
-    </tr>"
-
-def create_plug_table_row(plug: types.Plug, edit: bool):
-    return f"<tr>\
-    <td><a href=\"page/{html.escape(plug.charger.park.id + '.html' + ('?edit' if edit else ''),quote=True)}\">{html.escape(plug.id)}</a></td>\
-    <td>{html.escape(plug.charger.park.town)}</td>\
-    <td>{html.escape(plug.charger.manufacturer)}</td>\
-    <td>{html.escape(plug.charger.network)}</td>\
-    <td>{html.escape(plug.charger.model)}</td>\
-    <td>{RESULT_LUT[plug.final.tls_support if plug.final is not None else -1]}</td>\
-    <td>{RESULT_LUT[plug.final.din_support if plug.final is not None else -1]}</td>\
-    <td>{RESULT_LUT[plug.final.v2v13_support if plug.final is not None else -1]}</td>\
-    <td>{plug.final.preferred if plug.final is not None else RESULT_LUT[-1]}</td>\
-    </tr>"
+#Columns of the plug list, with the lookup table to display verdicts
+PLUG_LIST_COLUMNS: List[Tuple[str, str, Dict[Any, str] | None]] = [
+    ("id", "ID", None),
+    ("town", "Town", None),
+    ("manufacturer", "Manufacturer", None),
+    ("network", "Operator", None),
+    ("model", "Model", None),
+    ("tls_support", "TLS", RESULT_LUT),
+    ("din_support", "DIN", RESULT_LUT),
+    ("v2v13_support", "15118-2", RESULT_LUT),
+    ("preferred", "Preferred", None),
+]
+
+PLUG_LIST_TEXT_FILTERS = [("country", "Country"), ("manufacturer", "Manufacturer"), ("network", "Operator")]
+PLUG_LIST_VERDICT_FILTERS = [("tls_support", "TLS"), ("din_support", "DIN"), ("v2v13_support", "15118-2")]
+
+def create_filter_select(field: str, options: Dict[Any, str]):
+    options_str = "".join([f"<option value=\"{html.escape(str(k), quote=True)}\">{html.escape(v)}</option>" for k, v in options.items()])
+    return f"<select data-filter=\"{html.escape(field, quote=True)}\"><option value=\"\">Any</option>{options_str}</select>"
+
+#Index page, the rows are loaded from the /api/plugs endpoint by index.js as the table is scrolled.
+#fields is the order of the values in a row, distinct the values offered in the text filters.
+def create_plug_list_page(edit: bool, fields: List[str], distinct: Dict[str, List[str]]) -> str:
+    config = {
+        "api": "api/plugs",
+        "static": "api/plugs.json",
+        "edit": edit,
+        "fields": fields,
+        "columns": [{"field": f, "title": title, "lut": lut} for f, title, lut in PLUG_LIST_COLUMNS],
+    }
+
+    filters = "".join([
+        f"<label>{html.escape(title)} <input data-filter=\"{html.escape(f, quote=True)}\" list=\"list_{html.escape(f, quote=True)}\"></label>{create_datalist('list_' + f, distinct[f])}"
+        for f, title in PLUG_LIST_TEXT_FILTERS
+    ] + [
+        f"<label>{html.escape(title)} {create_filter_select(f, RESULT_LUT)}</label>"
+        for f, title in PLUG_LIST_VERDICT_FILTERS
+    ])
+
+    js_string = json.dumps(f"plug_list_init({json.dumps(config)});").replace("<", "\\u003c")
+
+    return create_page("List", "", f"<div class=\"plug_filters\">{filters} <span class=\"plug_count\"></span></div>\
+        <div class=\"plug_list\"><table class=\"result_table\"><thead></thead><tbody></tbody></table></div>\
+        <script>eval({js_string})</script>")
 
 #
 # Create page for components
@@ -286,4 +326,18 @@ def create_park_entry(park: types.Park, edit: bool, global_js: List[str]) -> str
         {create_photo_list(park.get_photos())} \
         {create_park_table_info(park, edit, global_js)}\
         {create_collapsable_list('Chargers', [create_charger_entry(c, edit, global_js) for c in park.chargers] + [create_add_new_button('charger', park.id + '.') for _ in range(1 if edit else 0)])} \
-    </div>")
\ No newline at end of file
+    </div>")
+
+#Full page of a park. Deterministic for the same park and mode, so it can be cached until the park is edited.
+def create_park_page(park: types.Park, edit: bool) -> str:
+    global_js: List[str] = []
+    with uid_scope("page"):
+        new_elem = create_park_entry(park, edit, global_js)
+
+    js_string = json.dumps(''.join(global_js)).replace("<", "\\u003c")
+
+    return create_page(
+        park.id,
+        "../",
+        new_elem + f"<script>eval({js_string})</script>"
+    )
@@ -0,0 +1,159 @@
+"""
+Rows of the plug list on the index page, for the /api/plugs endpoint.
+Filtering, sorting and cursor pagination are done on the server, so the browser only receives the rows it shows.
+The rows are built from the metadata once and again after edits, each filtered and sorted order is kept for later pages.
+"""
+
+from __future__ import annotations
+
+import base64
+import bisect
+from collections import OrderedDict
+import json
+from typing import Any, Callable, Dict, List, Tuple
+
+from .. import fleet_table
+from .. import metadata
+from .. import types
+
+#Columns of a row, in order
+FIELDS: Dict[str, Callable[[types.Plug], Any]] = {
+    "id": lambda plug: plug.id,
+    "park": lambda plug: plug.charger.park.id,
+    "country": lambda plug: fleet_table.CHARGER_FIELDS["country"](plug.charger),
+    "town": lambda plug: plug.charger.park.town,
+    "manufacturer": lambda plug: plug.charger.manufacturer,
+    "network": lambda plug: plug.charger.network,
+    "model": lambda plug: plug.charger.model,
+    "preferred": lambda plug: plug.final.preferred if plug.final is not None else "",
+} | {
+    f: (lambda f: lambda plug: getattr(plug.final, f) if plug.final is not None else -1)(f) for f in fleet_table.VERDICT_FIELDS
+}
+FIELD_INDEX = {f: i for i, f in enumerate(FIELDS)}
+
+#Columns that can be filtered on, by exact value
+FILTER_FIELDS = ["country", "manufacturer", "network"] + fleet_table.VERDICT_FIELDS
+
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+
+#Filtered and sorted orders kept, by query
+MAX_CACHED_ORDERS = 32
+
+Row = List[Any]
+
+#Position in a sort order, the sort column value and the plug ID
+def encode_cursor(key: Tuple[Any, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return value, id
+
+class PlugList():
+    meta: metadata.Metadata
+    rows: List[Row] | None
+    #(filters, sort field) -> (row indices in ascending order, their sort keys)
+    orders: OrderedDict[Tuple[Tuple[Tuple[str, str], ...], str], Tuple[List[int], List[Tuple[Any, str]]]]
+
+    def __init__(self, meta: metadata.Metadata):
+        self.meta = meta
+        self.rows = None
+        self.orders = OrderedDict()
+
+    #Rebuild the rows on the next query, after any change to the metadata or results
+    def invalidate(self):
+        self.rows = None
+        self.orders.clear()
+
+    def get_rows(self) -> List[Row]:
+        if self.rows is None:
+            getters = list(FIELDS.values())
+            self.rows = [[get(plug) for get in getters] for plug in self.meta.plugs.values()]
+        return self.rows
+
+    #Distinct values of a column, for the filter inputs
+    def distinct(self, field: str) -> List[str]:
+        idx = FIELD_INDEX[field]
+        return sorted({row[idx] for row in self.get_rows()})
+
+    def get_order(self, filters: Dict[str, str], sort: str) -> Tuple[List[int], List[Tuple[Any, str]]]:
+        key = (tuple(sorted(filters.items())), sort)
+        res = self.orders.get(key)
+        if res is not None:
+            self.orders.move_to_end(key)
+            return res
+
+        rows = self.get_rows()
+        #Filter values arrive as strings, verdicts are compared as numbers
+        conditions = [(FIELD_INDEX[f], int(v) if f in fleet_table.VERDICT_FIELDS else v) for f, v in filters.items()]
+        selected = [i for i, row in enumerate(rows) if all(row[idx] == v for idx, v in conditions)]
+
+        sort_idx = FIELD_INDEX[sort]
+        id_idx = FIELD_INDEX["id"]
+        keys = [(rows[i][sort_idx], rows[i][id_idx]) for i in selected]
+        order = sorted(range(len(selected)), key=keys.__getitem__)
+        res = ([selected[i] for i in order], [keys[i] for i in order])
+
+        self.orders[key] = res
+        if len(self.orders) > MAX_CACHED_ORDERS:
+            self.orders.popitem(last=False)
+        return res
+
+    #One page of rows from query arguments: filter fields, sort (a field, "-" in front for descending), limit and cursor.
+    #Raises ValueError for invalid arguments.
+    def query(self, args: Dict[str, str]) -> Dict[str, Any]:
+        filters = {f: args[f] for f in FILTER_FIELDS if args.get(f, "") != ""}
+        for f in fleet_table.VERDICT_FIELDS:
+            if f in filters and not filters[f].lstrip("-").isdigit():
+                raise ValueError(f"Invalid value for {f}")
+
+        sort = args.get("sort", "id")
+        descending = sort.startswith("-")
+        sort = sort.lstrip("-")
+        if sort not in FIELDS:
+            raise ValueError(f"Unknown sort field {sort}")
+
+        try:
+            limit = int(args.get("limit", DEFAULT_LIMIT))
+        except ValueError:
+            raise ValueError("Invalid limit")
+        limit = max(1, min(limit, MAX_LIMIT))
+
+        order, keys = self.get_order(filters, sort)
+        cursor = args.get("cursor")
+
+        #The cursor is the key of the last row sent, the page continues after it in the sort direction
+        try:
+            if not descending:
+                pos = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+            else:
+                pos = bisect.bisect_left(keys, decode_cursor(cursor)) if cursor else len(order)
+        except TypeError:
+            raise ValueError("Cursor does not match the sort field")
+
+        if not descending:
+            start = pos
+            end = min(start + limit, len(order))
+            page = range(start, end)
+            more = end < len(order)
+        else:
+            end = pos
+            start = max(end - limit, 0)
+            page = range(end - 1, start - 1, -1)
+            more = start > 0
+
+        rows = self.get_rows()
+        return {
+            "total": len(order),
+            "rows": [rows[order[i]] for i in page],
+            "next": encode_cursor(keys[page[-1]]) if more else None,
+        }
+
+    #All rows in the format of query, for the static website
+    def all(self) -> Dict[str, Any]:
+        rows = self.get_rows()
+        return {"total": len(rows), "rows": rows, "next": None}
@@ -3,6 +3,8 @@ from __future__ import annotations
 import os
 from quart import Quart, send_from_directory, request, jsonify, redirect, abort, render_template, send_file
 
+from . import http_cache
+
 def in_directory(full_path, directory):
     #make both absolute    
     directory = os.path.join(os.path.realpath(directory), '')
@@ -41,8 +43,11 @@ async def serve_static_file_helper(req_path, base, download):
 
     # Check if path is a file and serve
     if os.path.isfile(abs_path):
+        #Small text files are served from memory, compressed and with an ETag of their content
+        if not download and http_cache.cacheable_file(abs_path):
+            return http_cache.respond(http_cache.file_body(abs_path))
         #Add folder into download for file name in download mode
-        return await send_file(abs_path, as_attachment=download, attachment_filename="_".join(req_path.split("/")[-2:]))
+        return await send_file(abs_path, as_attachment=download, attachment_filename="_".join(req_path.split("/")[-2:]), conditional=True)
     
     return None
 
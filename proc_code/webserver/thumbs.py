@@ -0,0 +1,124 @@
+"""
+Thumbnails of the photos for the webserver.
+Resized with Pillow on first request in a thread pool, so the event loop keeps serving other requests, and kept in a disk
+cache limited in size, dropping the least recently used. A thumbnail gets the modification time of its photo and is made
+again when the photo changes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+from typing import Dict
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .. import path_tools
+
+#Heights the pages can ask for
+THUMB_SIZES = [200, 400, 800]
+
+#Total size of the thumbnails kept on disk
+CACHE_BYTES = 1024 * 1024 * 1024
+
+ORIENTATION_TAG = 0x0112
+#Wider images are limited by their width instead
+MAX_ASPECT = 10
+
+#Resize the photo at src to the height size, keeping the aspect and EXIF orientation, and write it to dst with the
+#modification time src_mtime_ns. Returns the size of the file.
+def make_thumbnail(src: str, dst: str, size: int, src_mtime_ns: int) -> int:
+    with Image.open(src) as image:
+        #Orientations 5 to 8 are rotated by 90 degrees, the height in the file is the width shown
+        rotated = image.getexif().get(ORIENTATION_TAG, 1) in (5, 6, 7, 8)
+        #Smaller than the box after, thumbnail also decodes JPEGs at a reduced scale
+        image.thumbnail((size, size * MAX_ASPECT) if rotated else (size * MAX_ASPECT, size))
+        thumb = ImageOps.exif_transpose(image)
+        if image.format == "JPEG" and thumb.mode not in ("RGB", "L"):
+            thumb = thumb.convert("RGB")
+
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        thumb.save(tmp, format=image.format, quality=85)
+    os.utime(tmp, ns=(src_mtime_ns, src_mtime_ns))
+    os.replace(tmp, dst)
+    return os.path.getsize(dst)
+
+class ThumbCache():
+    folder: str
+    max_bytes: int
+    #Path of each thumbnail -> its size in bytes, least recently used first
+    entries: OrderedDict[str, int]
+    total: int
+    #Thumbnails being made, so parallel requests for one wait for the same resize
+    pending: Dict[str, asyncio.Future]
+    executor: ThreadPoolExecutor
+
+    def __init__(self, folder: str, max_bytes: int = CACHE_BYTES, workers: int | None = None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total = 0
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        #Thumbnails of earlier runs, by last access
+        found = []
+        for root, _, files in os.walk(folder):
+            for fn in files:
+                path = os.path.join(root, fn)
+                if fn.endswith(".tmp"):
+                    os.remove(path)
+                    continue
+                st = os.stat(path)
+                found.append((st.st_atime, path, st.st_size))
+        for _, path, nbytes in sorted(found):
+            self.add(path, nbytes)
+        self.evict()
+
+    def add(self, path: str, nbytes: int):
+        self.total += nbytes - self.entries.get(path, 0)
+        self.entries[path] = nbytes
+        self.entries.move_to_end(path)
+
+    def evict(self):
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            path, nbytes = self.entries.popitem(last=False)
+            self.total -= nbytes
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    #Path of the thumbnail of the photo at rel below PHOTOS_DIR, made if missing or older than the photo.
+    #Raises FileNotFoundError if there is no such photo, UnidentifiedImageError if it is not an image.
+    async def get(self, size: int, rel: str) -> str:
+        src = os.path.join(path_tools.PHOTOS_DIR, rel)
+        dst = os.path.join(self.folder, str(size), rel)
+        src_mtime = os.stat(src).st_mtime_ns
+
+        if dst in self.entries:
+            try:
+                if os.stat(dst).st_mtime_ns == src_mtime:
+                    self.entries.move_to_end(dst)
+                    return dst
+            except FileNotFoundError:
+                pass
+
+        fut = self.pending.get(dst)
+        if fut is None:
+            fut = asyncio.get_running_loop().run_in_executor(self.executor, make_thumbnail, src, dst, size, src_mtime)
+            self.pending[dst] = fut
+            try:
+                self.add(dst, await fut)
+            finally:
+                del self.pending[dst]
+            self.evict()
+        else:
+            await fut
+        return dst
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
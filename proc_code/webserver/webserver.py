@@ -6,14 +6,20 @@ import os
 from quart import Quart, send_from_directory, request, jsonify, redirect, abort, render_template, send_file
 import logging
 import asyncio
+import threading
+from typing import Dict, Tuple
 
+from .. import load_data
 from .. import process_data
 
 from .. import path_tools
 from .. import types
 from .. import metadata
+from . import http_cache
 from . import page_gen
+from . import plug_list
 from . import static
+from . import thumbs
 
 logging.basicConfig()
 
@@ -41,20 +47,47 @@ async def main_webserver(meta: metadata.Metadata):
             False
         )
 
-    @app.route('/page/<park>.html')
-    async def serve_data_pages(park):
-        if park in meta.parks:
+    #Rendered park pages by (park, edit mode), dropped when anything in the park changes
+    page_cache: Dict[Tuple[str, bool], http_cache.Body] = {}
+    #Responses that show all plugs, dropped on any change
+    list_cache: Dict[str, http_cache.Body] = {}
+
+    #Rows of the index page, rebuilt after edits
+    plugs = plug_list.PlugList(meta)
+
+    def invalidate_park(park: str):
+        page_cache.pop((park, False), None)
+        page_cache.pop((park, True), None)
+        list_cache.clear()
+        plugs.invalidate()
+
+    thumb_cache = thumbs.ThumbCache(path_tools.THUMBS_CACHE_DIR)
 
-            global_js = []
-            new_elem = page_gen.create_park_entry(meta.parks[park], request.query_string.decode() == "edit", global_js)
+    #Held while the experiments of a plug are loaded from disk, outside of the event loop
+    details_lock = threading.Lock()
 
-            js_string = json.dumps(''.join(global_js)).replace("<", "\\u003c")
+    #Photos resized to a height of size for the pages, the full photos stay under /photos
+    @app.route('/thumbs/<int:size>/<path:path>')
+    async def serve_thumbs_handler(size: int, path: str):
+        if size not in thumbs.THUMB_SIZES:
+            return abort(404)
+        if not static.in_directory(os.path.realpath(os.path.join(path_tools.PHOTOS_DIR, path)), path_tools.PHOTOS_DIR):
+            return abort(403)
+        try:
+            thumb = await thumb_cache.get(size, path)
+        except (FileNotFoundError, IsADirectoryError, thumbs.UnidentifiedImageError):
+            return abort(404)
+        return await send_file(thumb, conditional=True)
 
-            return page_gen.create_page(
-                park,
-                "../",
-                new_elem + f"<script>eval({js_string})</script>"
-            )
+    @app.route('/page/<park>.html')
+    async def serve_data_pages(park):
+        if park in meta.parks:
+            key = (park, request.query_string.decode() == "edit")
+            page = page_cache.get(key)
+            if page is None:
+                page = http_cache.Body(page_gen.create_park_page(meta.parks[park], key[1]), "text/html")
+                page_cache[key] = page
+            return http_cache.respond(page)
         else:
             return abort(404)
 
@@ -69,6 +102,8 @@ async def main_webserver(meta: metadata.Metadata):
         obj.lat = float(data["lat"])
         obj.long = float(data["long"])
         obj.notes = data["notes"]
+        obj.metadata_dirty = True
+        invalidate_park(obj.id)
 
         global_js = []
         new_elem = page_gen.create_park_table_info(obj, True, global_js)
@@ -86,6 +121,8 @@ async def main_webserver(meta: metadata.Metadata):
         obj.mfg_detail = data["mfg_detail"]
         obj.sn = data["sn"]
         obj.notes = data["notes"]
+        obj.metadata_dirty = True
+        invalidate_park(obj.park.id)
 
         global_js = []
         new_elem = page_gen.create_charger_table_info(obj, True, global_js)
@@ -97,6 +134,8 @@ async def main_webserver(meta: metadata.Metadata):
         obj = meta.plugs[plug]
         obj.position = data["position"]
         obj.notes = data["notes"]
+        obj.metadata_dirty = True
+        invalidate_park(obj.charger.park.id)
 
         global_js = []
         new_elem = page_gen.create_plug_table_info(obj, True, global_js)
@@ -117,9 +156,11 @@ async def main_webserver(meta: metadata.Metadata):
             photos = "",
             notes = "",
 
-            chargers = []
+            chargers = [],
+            metadata_dirty = True,
         )
         meta.parks[park] = res
+        invalidate_park(park)
 
         global_js = []
         new_elem = page_gen.create_park_entry(res, True, global_js)
@@ -146,10 +187,12 @@ async def main_webserver(meta: metadata.Metadata):
             photos = "",
             notes = "",
             
-            plugs = []
+            plugs = [],
+            metadata_dirty = True,
         )
         meta.chargers[charger] = res
         park.chargers.append(res)
+        invalidate_park(park.id)
 
         global_js = []
         new_elem = page_gen.create_charger_entry(res, True, global_js)
@@ -173,10 +216,12 @@ async def main_webserver(meta: metadata.Metadata):
             reduced= None,
             final = None,
             final_sync_with_disk = False,
+            metadata_dirty = True,
         )
         res.final = types.FinalResult()
         meta.plugs[plug] = res
         charger.plugs.append(res)
+        invalidate_park(charger.park.id)
 
         global_js = []
         new_elem = page_gen.create_plug_entry(res, True, global_js)
@@ -189,6 +234,7 @@ async def main_webserver(meta: metadata.Metadata):
         if obj.final is None:
              obj.final = types.FinalResult()
         obj.final.computed = False
+        obj.final_sync_with_disk = False
         obj.final.nmk_random = int(data["nmk_random"])
         obj.final.nid_match = int(data["nid_match"])
 
@@ -212,16 +258,58 @@ async def main_webserver(meta: metadata.Metadata):
         obj.final.phy_mac = data["phy_mac"]
         obj.final.phy_mfg = data["phy_mfg"]
         obj.final.phy_usr = data["phy_usr"]
-        
+        invalidate_park(obj.charger.park.id)
+
         global_js = []
         new_elem = page_gen.create_plug_table_results(obj, True, global_js)
         return {"ok": True, "status": "OK", "elem": new_elem, "code": global_js}
 
+    #Runs in a thread, one plug at a time, as loading and releasing change the plug
+    def plug_experiments_json(obj: types.Plug) -> str:
+        with details_lock:
+            load_data.refresh_experiment_index(obj)
+            experiments = process_data.load_plug_details(obj)
+            res = {
+                "experiments": [
+                    {"path": os.path.relpath(exp.path, obj.get_path()), "time": exp.time} | exp.results.to_json()
+                for exp in experiments],
+                "reduced": obj.reduced.to_json() if obj.reduced is not None else None,
+            }
+            process_data.release_plug(obj)
+        return json.dumps(res)
+
+    #Processed results of each experiment of a plug, loaded from disk on request and released again afterwards
+    @app.route('/api/plug/<plug>/experiments')
+    async def serve_plug_experiments(plug: str):
+        if plug not in meta.plugs:
+            return abort(404)
+        data = await asyncio.get_running_loop().run_in_executor(None, plug_experiments_json, meta.plugs[plug])
+        return http_cache.respond(http_cache.Body(data, "application/json"))
+
+    #One page of the plug list, see plug_list.PlugList.query for the arguments
+    @app.route('/api/plugs')
+    async def serve_plugs():
+        try:
+            return http_cache.respond(http_cache.Body(json.dumps(plugs.query(request.args.to_dict())), "application/json"))
+        except ValueError as e:
+            return {"ok": False, "status": str(e)}, 400
+
+    #All plugs in one response, downloaded for the static website
+    @app.route('/api/plugs.json')
+    async def serve_plugs_all():
+        if "plugs.json" not in list_cache:
+            list_cache["plugs.json"] = http_cache.Body(json.dumps(plugs.all()), "application/json")
+        return http_cache.respond(list_cache["plugs.json"])
+
     @app.route('/')
     @app.route('/index.html')
     async def handle_root():
-        page_content = "".join([page_gen.create_plug_table_row(plug, request.query_string.decode() == "edit") for plug in meta.plugs.values()])
-        return page_gen.create_page("List","", f"<table class=\"result_table\">{page_gen.create_plug_table_header()}{page_content}</table>")
+        edit = request.query_string.decode() == "edit"
+        key = "index_edit" if edit else "index"
+        if key not in list_cache:
+            distinct = {f: plugs.distinct(f) for f, _ in page_gen.PLUG_LIST_TEXT_FILTERS}
+            list_cache[key] = http_cache.Body(page_gen.create_plug_list_page(edit, list(plug_list.FIELDS), distinct), "text/html")
+        return http_cache.respond(list_cache[key])
     
 
 
@@ -232,20 +320,41 @@ async def main_webserver(meta: metadata.Metadata):
     #ssl_cert = os.path.join(os.path.dirname(os.path.realpath(__file__)),"www/certs/certificate.pem")
     #ssl_key = os.path.join(os.path.dirname(os.path.realpath(__file__)),"www/certs/key.pem")
 
-    await app.run_task(host="0.0.0.0", port=8000)#, certfile=ssl_cert, keyfile=ssl_key)
+    try:
+        await app.run_task(host="0.0.0.0", port=8000)#, certfile=ssl_cert, keyfile=ssl_key)
+    finally:
+        thumb_cache.close()
+
+
+#Seconds between saves of the changed data
+AUTOSAVE_INTERVAL = 30
+
+#Write the metadata tables and plug results changed by the API since the last save, returns the number of each written
+def save_changes(meta: metadata.Metadata) -> Tuple[int, int]:
+    return metadata.save_charger_metadata_table(meta, only_dirty=True), process_data.save_dirty_plugs(meta.plugs.values())
 
+#Save changes in the background, so a crash loses at most the last interval of edits
+async def autosave(meta: metadata.Metadata, interval: float = AUTOSAVE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            tables, plugs = save_changes(meta)
+            if tables > 0 or plugs > 0:
+                print(f"Saved {tables} metadata tables and {plugs} plugs")
+        except Exception:
+            #Flags of unsaved objects stay set, the next save tries again
+            logging.exception("Autosave failed")
 
 async def main():
     meta =  metadata.read_charger_metadata_table()
-    for plug in meta.plugs.values():
-        process_data.load_or_process_plug(plug, 1)
+    #Only the verdicts are kept in memory, details are loaded when asked for
+    process_data.process_all_plugs(meta, 1, release=True)
+    saver = asyncio.create_task(autosave(meta))
     try:
         await main_webserver(meta)
     finally:
-        metadata.save_charger_metadata_table(meta)
-        for plug in meta.plugs.values():
-            if not plug.final_sync_with_disk:
-                process_data.save_plug(plug)
+        saver.cancel()
+        save_changes(meta)
 
 def syncmain():
     asyncio.run(main())
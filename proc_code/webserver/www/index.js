@@ -69,4 +69,192 @@ function create_api_form(location, args, root, button) {
             document.getElementById(button).disabled = false;
         }
     })
-}
\ No newline at end of file
+}
+
+//Plug list of the index page. Rows are fetched from the server a page at a time as the table is scrolled, and only the
+//rows in view are in the DOM. The static website has no API, there all rows are loaded from one JSON file and filtered here.
+const PLUG_LIST_ROW_HEIGHT = 28;
+const PLUG_LIST_OVERSCAN = 20;
+const PLUG_LIST_PAGE = 200;
+const PLUG_LIST_MAX_PAGE = 1000;
+
+function html_escape(s) {
+    return String(s).replace(/[&<>"']/g, (c) => ({"&": "&amp;", "<": "&lt;", ">": "&gt;", "\"": "&quot;", "'": "&#39;"}[c]));
+}
+
+function plug_list_init(config) {
+    const state = {
+        config: config,
+        container: document.querySelector(".plug_list"),
+        tbody: document.querySelector(".plug_list tbody"),
+        field_idx: Object.fromEntries(config.fields.map((f, i) => [f, i])),
+        query: {"sort": "id"},
+        //Rows loaded so far, in order
+        rows: [],
+        total: 0,
+        next: null,
+        done: false,
+        loading: false,
+        //Increased on every change of the query, to drop responses of older ones
+        generation: 0,
+        //All rows on the static website, null while the API is used
+        static_rows: null,
+        static_order: null,
+    };
+
+    state.container.onscroll = () => plug_list_render(state);
+    window.addEventListener("resize", () => plug_list_render(state));
+
+    document.querySelectorAll("[data-filter]").forEach((elem) => {
+        let timeout = null;
+        const update = () => {
+            state.query[elem.dataset.filter] = elem.value;
+            plug_list_reset(state);
+        };
+        elem.oninput = () => {
+            clearTimeout(timeout);
+            timeout = setTimeout(update, 200);
+        };
+        elem.onchange = () => {
+            clearTimeout(timeout);
+            update();
+        };
+    });
+
+    plug_list_header(state);
+    plug_list_reset(state);
+}
+
+function plug_list_header(state) {
+    const sort = state.query["sort"];
+    const thead = document.querySelector(".plug_list thead");
+    thead.innerHTML = "<tr>" + state.config.columns.map((col) => {
+        const arrow = sort === col.field ? " ▲" : (sort === "-" + col.field ? " ▼" : "");
+        return `<th data-field="${html_escape(col.field)}">${html_escape(col.title)}${arrow}</th>`;
+    }).join("") + "</tr>";
+    thead.querySelectorAll("th").forEach((th) => {
+        th.onclick = () => {
+            state.query["sort"] = state.query["sort"] === th.dataset.field ? "-" + th.dataset.field : th.dataset.field;
+            plug_list_header(state);
+            plug_list_reset(state);
+        };
+    });
+}
+
+function plug_list_reset(state) {
+    state.generation += 1;
+    state.rows = [];
+    state.total = 0;
+    state.next = null;
+    state.done = false;
+    state.loading = false;
+    state.static_order = null;
+    state.container.scrollTop = 0;
+    plug_list_load(state, PLUG_LIST_PAGE);
+}
+
+//Fetch rows until at least needed are loaded
+async function plug_list_load(state, needed) {
+    if (state.loading) {
+        return;
+    }
+    state.loading = true;
+    const generation = state.generation;
+    try {
+        while (state.rows.length < needed && !state.done) {
+            const limit = Math.min(Math.max(PLUG_LIST_PAGE, needed - state.rows.length), PLUG_LIST_MAX_PAGE);
+            const res = await plug_list_fetch(state, state.next, limit);
+            if (generation !== state.generation) {
+                return;
+            }
+            state.rows.push(...res["rows"]);
+            state.total = res["total"];
+            state.next = res["next"];
+            state.done = res["next"] === null;
+        }
+    } catch (error) {
+        console.error('Error loading plugs:', error);
+    }
+    if (generation === state.generation) {
+        state.loading = false;
+        plug_list_render(state);
+    }
+}
+
+async function plug_list_fetch(state, cursor, limit) {
+    if (state.static_rows === null) {
+        const params = new URLSearchParams(Object.entries(state.query).filter(([k, v]) => v !== ""));
+        params.set("limit", limit);
+        if (cursor !== null) {
+            params.set("cursor", cursor);
+        }
+        const response = await fetch(state.config.api + "?" + params.toString());
+        if (response.ok) {
+            return await response.json();
+        }
+        if (response.status !== 404) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const all = await fetch(state.config.static);
+        state.static_rows = (await all.json())["rows"];
+    }
+    return plug_list_fetch_static(state, cursor, limit);
+}
+
+//Same filtering and order as the API, the cursor is the offset
+function plug_list_fetch_static(state, cursor, limit) {
+    if (state.static_order === null) {
+        const filters = Object.entries(state.query).filter(([k, v]) => k !== "sort" && v !== "").map(([k, v]) => [state.field_idx[k], v]);
+        const sort = state.query["sort"].replace(/^-/, "");
+        const sign = state.query["sort"].startsWith("-") ? -1 : 1;
+        const sort_idx = state.field_idx[sort];
+        const id_idx = state.field_idx["id"];
+        const cmp = (a, b) => (a < b ? -1 : (a > b ? 1 : 0));
+        state.static_order = state.static_rows
+            .filter((row) => filters.every(([idx, v]) => String(row[idx]) === v))
+            .sort((a, b) => sign * (cmp(a[sort_idx], b[sort_idx]) || cmp(a[id_idx], b[id_idx])));
+    }
+    const start = cursor === null ? 0 : cursor;
+    const end = Math.min(start + limit, state.static_order.length);
+    return {
+        "total": state.static_order.length,
+        "rows": state.static_order.slice(start, end),
+        "next": end < state.static_order.length ? end : null,
+    };
+}
+
+function plug_list_row(state, row) {
+    const park = row[state.field_idx["park"]];
+    const href = "page/" + park + ".html" + (state.config.edit ? "?edit" : "");
+    const cells = state.config.columns.map((col) => {
+        const v = row[state.field_idx[col.field]];
+        if (col.field === "id") {
+            return `<td><a href="${html_escape(href)}">${html_escape(v)}</a></td>`;
+        }
+        return `<td>${html_escape(col.lut !== null ? col.lut[String(v)] : v)}</td>`;
+    });
+    return `<tr class="plug_row">${cells.join("")}</tr>`;
+}
+
+//Rows in view and a margin around them, the rest of the table is taken up by two empty rows
+function plug_list_render(state) {
+    const container = state.container;
+    let start = Math.max(0, Math.floor(container.scrollTop / PLUG_LIST_ROW_HEIGHT) - PLUG_LIST_OVERSCAN);
+    //Start on an even row, so the row colours do not change while scrolling
+    start -= start % 2;
+    const end = Math.min(state.total, start + Math.ceil(container.clientHeight / PLUG_LIST_ROW_HEIGHT) + 2 * PLUG_LIST_OVERSCAN);
+
+    if (end > state.rows.length && !state.done) {
+        plug_list_load(state, end);
+    }
+
+    const shown_end = Math.max(start, Math.min(end, state.rows.length));
+    const rows = [`<tr class="spacer" style="height: ${start * PLUG_LIST_ROW_HEIGHT}px"></tr>`];
+    for (let i = start; i < shown_end; i++) {
+        rows.push(plug_list_row(state, state.rows[i]));
+    }
+    rows.push(`<tr class="spacer" style="height: ${(state.total - shown_end) * PLUG_LIST_ROW_HEIGHT}px"></tr>`);
+    state.tbody.innerHTML = rows.join("");
+
+    document.querySelector(".plug_count").textContent = `${state.total} plugs`;
+}